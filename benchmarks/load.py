@@ -0,0 +1,245 @@
+"""Replay recorded webhook deliveries through pcts.http against local stand-ins
+
+Record a bundle by setting `directory` in the `[recording]` section of the
+service configuration, then run from the repository root:
+
+    python -m benchmarks.load /var/lib/pcts/recording --rates 0.5 1 2 --workers 1 2 4
+
+"""
+import argparse
+import asyncio
+import configparser
+import datetime
+import functools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import tempfile
+import time
+import uuid
+
+import aiohttp
+
+import pcts.github
+import pcts.http
+import pcts.impact
+import pcts.puppet
+import pcts.worker
+from pcts.version import __version__
+
+from benchmarks.replay import ReplayBundle, ReplayPuppetDB, ReplayPullRequest
+from benchmarks.stub_es import StubElasticsearch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bundle', type=str,
+                        help='The directory holding the recorded replay bundle')
+    parser.add_argument('--rates', type=float, nargs='+', default=[1.0],
+                        help='The mean arrival rates to replay deliveries at, in deliveries per second')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help='The numbers of concurrent queue workers to test')
+    parser.add_argument('-n', '--deliveries', type=int, default=100,
+                        help='The number of deliveries to send for each configuration')
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='The factor to apply to recorded dependency latencies')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed for delivery selection and arrival times')
+    parser.add_argument('-o', '--output', type=str, default='load_results.json',
+                        help='The file to write machine-readable results to')
+    return parser.parse_args()
+
+
+def make_config(executables, es_config, environments_dir):
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'puppetdb': {
+            'base_uri': 'https://puppetdb.replay:8081',
+            'ssl_host_key': '',
+            'ssl_host_cert': '',
+            'ssl_ca_cert': '',
+        },
+        'elasticsearch': {
+            'host': es_config['host'],
+            'port': es_config['port'],
+            'index': es_config['index'],
+            'dashboard': 'https://localhost/',
+        },
+        'github': {
+            'auth_token': '',
+        },
+        'executables': executables,
+        'preview': {
+            'excludes_file': '',
+        },
+        'recording': {
+            'directory': '',
+        },
+        'archive': {
+            'directory': '',
+            'chunk_size': 64,
+        },
+        'environments': {
+            'directory': environments_dir,
+            'state_file': os.path.join(environments_dir, 'state.json'),
+            'max_count': 0,
+            'max_size': 0,
+            'keep_warm': 0,
+        },
+    })
+    return config
+
+
+def percentile(samples, percent):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(percent / 100.0 * len(ordered)) - 1)]
+
+
+def summarize(samples):
+    return dict([('count', len(samples))] +
+                [('p{}'.format(p), percentile(samples, p)) for p in (50, 90, 95, 99, 100)])
+
+
+def tracking(handler_f, completed, failed):
+    @asyncio.coroutine
+    def tracked_handler(payload, id, config, **kwargs):
+        try:
+            yield from handler_f(payload=payload, id=id, config=config, **kwargs)
+        except:
+            failed[str(id)] = time.monotonic()
+            raise
+        completed[str(id)] = time.monotonic()
+    return tracked_handler
+
+
+@asyncio.coroutine
+def send_delivery(session, url, bundle, delivery, sent, responses):
+    delivery_id = str(uuid.uuid4())
+    bundle.replayed[delivery_id] = delivery['id']
+    headers = {
+        'Content-Type': 'application/json',
+        'X-GitHub-Event': delivery['event'],
+        'X-GitHub-Delivery': delivery_id,
+    }
+    sent[delivery_id] = time.monotonic()
+    response = yield from session.post(url, data=delivery['body'].encode('utf8'), headers=headers)
+    yield from response.release()
+    responses.append(time.monotonic() - sent[delivery_id])
+
+
+@asyncio.coroutine
+def run_configuration(loop, bundle, config, workers, rate, deliveries, rng):
+    logger = logging.getLogger(__name__)
+    # Every configuration starts cold rather than reusing the previous one's cached lookups
+    pcts.puppet.query_cache.clear()
+    pcts.impact.template_indexes.clear()
+    queue = pcts.http.MessageQueue()
+    app = pcts.http.make_app(loop, queue)
+    handler = app.make_handler()
+    server = yield from loop.create_server(handler, '127.0.0.1', 0)
+    url = 'http://127.0.0.1:{}/'.format(server.sockets[0].getsockname()[1])
+    worker_fs = [asyncio.async(pcts.worker.worker(queue=queue, config=config)) for _ in range(workers)]
+
+    sent = dict()
+    completed = dict()
+    failed = dict()
+    responses = []
+    original_handlers = pcts.worker.handlers.copy()
+    for event_type, handler_f in original_handlers.items():
+        pcts.worker.handlers[event_type] = tracking(handler_f, completed, failed)
+
+    logger.info('Replaying %s deliveries at %s/s with %s workers', deliveries, rate, workers)
+    session = aiohttp.ClientSession(loop=loop)
+    try:
+        send_fs = []
+        start = time.monotonic()
+        for _ in range(deliveries):
+            yield from asyncio.sleep(rng.expovariate(rate))
+            delivery = rng.choice(bundle.deliveries)
+            send_fs.append(asyncio.async(send_delivery(session, url, bundle, delivery, sent, responses)))
+        yield from asyncio.wait(send_fs)
+        yield from queue.join()
+        end = time.monotonic()
+    finally:
+        session.close()
+        pcts.worker.handlers.update(original_handlers)
+        for worker_f in worker_fs:
+            worker_f.cancel()
+        server.close()
+        yield from server.wait_closed()
+        yield from handler.finish_connections()
+
+    latencies = [completed[delivery_id] - sent[delivery_id] for delivery_id in completed if delivery_id in sent]
+    return {
+        'workers': workers,
+        'arrival_rate': rate,
+        'deliveries': deliveries,
+        'processed': len(completed),
+        'errors': len(failed),
+        'elapsed': end - start,
+        'throughput': len(completed) / (end - start),
+        'response_latency': summarize(responses),
+        'end_to_end_latency': summarize(latencies),
+    }
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    bundle = ReplayBundle(args.bundle)
+    if not bundle.deliveries:
+        raise SystemExit('No recorded deliveries found in {}'.format(args.bundle))
+
+    loop = asyncio.get_event_loop()
+    rng = random.Random(args.seed)
+    original_classes = (pcts.github.PullRequest, pcts.puppet.PuppetDB)
+    pcts.github.PullRequest = functools.partial(ReplayPullRequest, bundle, args.latency_scale)
+    pcts.puppet.PuppetDB = functools.partial(ReplayPuppetDB, bundle, args.latency_scale)
+
+    results = []
+    try:
+        with StubElasticsearch() as stub, tempfile.TemporaryDirectory() as responses_dir:
+            executables = bundle.write_executables(responses_dir, args.latency_scale)
+            config = make_config(executables, stub.config, responses_dir)
+            for workers in args.workers:
+                for rate in args.rates:
+                    result = loop.run_until_complete(run_configuration(loop=loop,
+                                                                       bundle=bundle,
+                                                                       config=config,
+                                                                       workers=workers,
+                                                                       rate=rate,
+                                                                       deliveries=args.deliveries,
+                                                                       rng=rng))
+                    results.append(result)
+                    print('{0} workers at {1}/s: {2:.2f} deliveries/s, p50 {3:.2f}s, p99 {4:.2f}s end to end, '
+                          '{5} errors'.format(
+                        workers,
+                        rate,
+                        result['throughput'],
+                        result['end_to_end_latency']['p50'] or 0,
+                        result['end_to_end_latency']['p99'] or 0,
+                        result['errors'],
+                    ))
+    finally:
+        pcts.github.PullRequest, pcts.puppet.PuppetDB = original_classes
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'pcts_version': __version__,
+            'python_version': platform.python_version(),
+            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+            'bundle': args.bundle,
+            'latency_scale': args.latency_scale,
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    print('Wrote results to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
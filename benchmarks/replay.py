@@ -0,0 +1,152 @@
+import asyncio
+import datetime
+import json
+import os
+import stat
+import sys
+import time
+
+import pcts.puppet
+
+from benchmarks.replay_exec import response_key
+
+
+def load_records(directory, kind):
+    path = os.path.join(directory, '{}.jsonl'.format(kind))
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def mean(values, default=0.0):
+    return sum(values) / len(values) if values else default
+
+
+class ReplayBundle:
+    """Deliveries and dependency responses recorded by pcts.recording
+
+    GitHub responses are looked up by pull request and PuppetDB responses by
+    the delivery they were recorded for, so a delivery can be replayed any
+    number of times under new delivery IDs as long as they are registered in
+    `replayed`. When the same request was recorded more than once the latest
+    response wins.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.deliveries = load_records(directory, 'deliveries')
+        self.pull_requests = dict()
+        self.files = dict()
+        self.status_latencies = dict()
+        for record in load_records(directory, 'github'):
+            key = (record['repository'], record['number'])
+            if record['call'] == 'get_pull':
+                self.pull_requests[key] = record
+            elif record['call'] == 'get_files':
+                self.files[key] = record
+            elif record['call'] == 'update_status':
+                self.status_latencies.setdefault(key, []).append(record['latency'])
+        # PuppetDB records are either the affected nodes found for a delivery,
+        # cached or not, or a query actually sent to PuppetDB with its latency
+        self.puppetdb = dict()
+        self.queries = dict()
+        for record in load_records(directory, 'puppetdb'):
+            if 'message_id' in record:
+                self.puppetdb[record['message_id']] = record
+            else:
+                self.queries[record['query']] = record
+        # Replayed delivery ID -> ID of the recorded delivery it replays
+        self.replayed = dict()
+
+    def status_latency(self, repository, number):
+        all_latencies = [latency for latencies in self.status_latencies.values() for latency in latencies]
+        return mean(self.status_latencies.get((repository, number), []), default=mean(all_latencies))
+
+    def puppetdb_response(self, message_id, query):
+        """The PuppetDB response and latency to replay for the delivery replayed as `message_id`
+
+        Impact analysis can't read the recorded environments during replay, so
+        `query` may differ from the recorded one. It is only used to find the
+        latency of the matching recorded query, falling back to the mean.
+        """
+        response = self.puppetdb[self.replayed[str(message_id)]]['response']
+        all_latencies = [record['latency'] for record in self.queries.values()]
+        latency = self.queries[query]['latency'] if query in self.queries else mean(all_latencies)
+        return response, latency
+
+    def export_responses(self, target):
+        """Split recorded subprocess output into one file per request for replay_exec"""
+        for record in load_records(self.directory, 'preview'):
+            key = response_key('preview', record['baseline_environment'], record['preview_environment'])
+            with open(os.path.join(target, key + '.json'), 'w') as f:
+                json.dump(record, f)
+        for record in load_records(self.directory, 'armature'):
+            key = response_key('armature', record['ref'], record['environment'])
+            with open(os.path.join(target, key + '.json'), 'w') as f:
+                json.dump(record, f)
+
+    def write_executables(self, target, latency_scale):
+        """Write `puppet` and `armature` stand-ins into `target`, returning their paths"""
+        self.export_responses(target)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        executables = dict()
+        for kind in ('puppet', 'armature'):
+            path = os.path.join(target, kind)
+            with open(path, 'w') as f:
+                f.write('#!/bin/sh\n')
+                f.write('PYTHONPATH="{0}" exec "{1}" -m benchmarks.replay_exec "{2}" {3} {4} "$@"\n'.format(
+                    root, sys.executable, target, latency_scale, kind))
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+            executables[kind] = path
+        return executables
+
+
+class ReplayPullRequest:
+    """Stand-in for pcts.github.PullRequest
+
+    PyGithub calls block the event loop in production, so the recorded
+    latencies are replayed with blocking sleeps as well.
+    """
+    def __init__(self, bundle, latency_scale, payload, auth_token):
+        self.bundle = bundle
+        self.latency_scale = latency_scale
+        self.key = (payload['repository']['full_name'], payload['number'])
+        record = bundle.pull_requests[self.key]
+        time.sleep(record['latency'] * latency_scale)
+        self.number = payload['number']
+        self.repo = record['response']['repo']
+        self.base_ref = record['response']['base_ref']
+        self.merge_sha = record['response'].get('merge_sha')
+        self.patches = dict()
+        self.updated_time = datetime.datetime.strptime(record['response']['updated_time'][:19],
+                                                       '%Y-%m-%dT%H:%M:%S')
+
+    @asyncio.coroutine
+    def update_status(self, state, target_url, message_id, description=None):
+        time.sleep(self.bundle.status_latency(*self.key) * self.latency_scale)
+
+    def get_files(self):
+        record = self.bundle.files[self.key]
+        time.sleep(record['latency'] * self.latency_scale)
+        self.patches = record.get('patches', dict())
+        return record['response']
+
+
+class ReplayPuppetDB(pcts.puppet.PuppetDB):
+    """Stand-in for pcts.puppet.PuppetDB answering queries from the bundle"""
+    def __init__(self, bundle, latency_scale, pdb_config):
+        super().__init__(pdb_config=pdb_config)
+        self.bundle = bundle
+        self.latency_scale = latency_scale
+        self.message_id = None
+
+    @asyncio.coroutine
+    def get_nodes_by_files(self, filenames, message_id, **kwargs):
+        self.message_id = message_id
+        return (yield from super().get_nodes_by_files(filenames, message_id, **kwargs))
+
+    @asyncio.coroutine
+    def query(self, query):
+        response, latency = self.bundle.puppetdb_response(self.message_id, query)
+        yield from asyncio.sleep(latency * self.latency_scale)
+        return response
@@ -0,0 +1,50 @@
+"""Stand-in for the `puppet` and `armature` executables during load tests
+
+Invoked by the wrappers written by ReplayBundle.write_executables as
+
+    python -m benchmarks.replay_exec <responses directory> <latency scale> <puppet|armature> <args...>
+
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+
+
+def response_key(*parts):
+    return hashlib.sha1(json.dumps(parts).encode('utf8')).hexdigest()
+
+
+def get_option(args, name):
+    return args[args.index(name) + 1]
+
+
+def main():
+    directory, latency_scale, kind = sys.argv[1:4]
+    args = sys.argv[4:]
+    if kind == 'puppet':
+        # Drain the node list so the caller never blocks writing to our stdin
+        sys.stdin.read()
+        key = response_key('preview',
+                           get_option(args, '--baseline-environment'),
+                           get_option(args, '--preview-environment'))
+    else:
+        _, _, ref, environment = args[:4]
+        key = response_key('armature', ref, environment)
+
+    path = os.path.join(directory, key + '.json')
+    if not os.path.exists(path):
+        sys.stderr.write('No recorded {0} response for arguments {1}\n'.format(kind, ' '.join(args)))
+        sys.exit(1)
+    with open(path) as f:
+        record = json.load(f)
+
+    time.sleep(record['latency'] * float(latency_scale))
+    sys.stdout.write(record['stdout'])
+    sys.stderr.write(record['stderr'])
+    sys.exit(record['return_code'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Benchmark report processing and bulk submission against synthetic reports
+
+Run from the repository root:
+
+    python -m benchmarks.report_pipeline --nodes 100 1000 10000 --output benchmark_results.json
+
+"""
+import argparse
+import asyncio
+import copy
+import datetime
+import json
+import logging
+import platform
+import statistics
+import time
+import tracemalloc
+
+import pcts.elasticsearch
+from pcts.version import __version__
+
+from benchmarks.reports import BenchmarkPullRequest, generate_report
+from benchmarks.stub_es import StubElasticsearch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nodes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='The node counts to generate reports for')
+    parser.add_argument('--compilation-errors', type=int, default=20,
+                        help='The number of manifests with compilation errors in each report')
+    parser.add_argument('--resource-types', type=int, default=10,
+                        help='The number of resource types with conflicting resources')
+    parser.add_argument('--conflicting-resources', type=int, default=10,
+                        help='The number of conflicting resources per resource type')
+    parser.add_argument('--attribute-issues', type=int, default=3,
+                        help='The number of conflicting attributes per resource type')
+    parser.add_argument('--added-edges', type=int, default=100,
+                        help='The number of added edges in each report')
+    parser.add_argument('--warnings', type=int, default=10,
+                        help='The number of warning issue codes in each report')
+    parser.add_argument('--affected-fraction', type=float, default=0.1,
+                        help='The fraction of nodes affected by each error, conflict and edge')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='The number of times to run each measurement')
+    parser.add_argument('--skip-bulk', action='store_true',
+                        help='Do not measure bulk submission against the stub Elasticsearch')
+    parser.add_argument('-o', '--output', type=str, default='benchmark_results.json',
+                        help='The file to write machine-readable results to')
+    return parser.parse_args()
+
+
+def summarize(samples):
+    return {
+        'samples': samples,
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'max': max(samples),
+    }
+
+
+def process(report, pr, message_id):
+    summary, nodes, errors, warnings, resource_changes, edge_changes = pcts.elasticsearch.process_report(
+        report, pr, message_id)
+    return pcts.elasticsearch.generate_actions(summary=summary,
+                                               nodes=nodes,
+                                               errors=errors,
+                                               warnings=warnings,
+                                               resource_changes=resource_changes,
+                                               edge_changes=edge_changes,
+                                               pr=pr,
+                                               index='pcts-benchmark-{isoyear}.{isoweek}',
+                                               message_id=message_id)
+
+
+def measure_processing(report, pr, repeat):
+    # process_report modifies the report in place, so every run gets its own copy
+    wall_times = []
+    actions = None
+    for i in range(repeat):
+        run_report = copy.deepcopy(report)
+        start = time.perf_counter()
+        actions = process(run_report, pr, 'benchmark-{}'.format(i))
+        wall_times.append(time.perf_counter() - start)
+
+    # tracemalloc slows allocation down considerably, so peak memory gets a separate run
+    run_report = copy.deepcopy(report)
+    tracemalloc.start()
+    process(run_report, pr, 'benchmark-memory')
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    documents = dict()
+    for action in actions:
+        documents[action['_type']] = documents.get(action['_type'], 0) + 1
+    return {
+        'wall_time': summarize(wall_times),
+        'peak_memory_bytes': peak_memory,
+        'documents': len(actions),
+        'documents_by_type': documents,
+    }, actions
+
+
+def measure_bulk(actions, stub, repeat, loop):
+    wall_times = []
+    bytes_sent = []
+    for i in range(repeat):
+        stub.reset()
+        run_actions = copy.deepcopy(actions)
+        start = time.perf_counter()
+        loop.run_until_complete(pcts.elasticsearch.send_to_es(actions=run_actions,
+                                                              config=stub.config,
+                                                              message_id='benchmark-{}'.format(i)))
+        wall_times.append(time.perf_counter() - start)
+        bytes_sent.append(stub.bytes_received)
+    return {
+        'wall_time': summarize(wall_times),
+        'bytes_sent': summarize(bytes_sent),
+        'documents': stub.documents_received,
+    }
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    pr = BenchmarkPullRequest()
+    loop = asyncio.get_event_loop()
+    results = []
+
+    with StubElasticsearch() as stub:
+        for node_count in args.nodes:
+            parameters = {
+                'node_count': node_count,
+                'compilation_errors': args.compilation_errors,
+                'resource_types': args.resource_types,
+                'conflicting_resources': args.conflicting_resources,
+                'attribute_issues': args.attribute_issues,
+                'added_edges': args.added_edges,
+                'warnings': args.warnings,
+                'affected_fraction': args.affected_fraction,
+            }
+            report = generate_report(**parameters)
+            processing, actions = measure_processing(report, pr, args.repeat)
+            result = {
+                'parameters': parameters,
+                'report_bytes': len(json.dumps(report)),
+                'process_report': processing,
+            }
+            if not args.skip_bulk:
+                result['bulk'] = measure_bulk(actions, stub, args.repeat, loop)
+            results.append(result)
+            print('{0} nodes: {1:.3f}s median processing, {2} documents, {3} bytes peak memory'.format(
+                node_count,
+                processing['wall_time']['median'],
+                processing['documents'],
+                processing['peak_memory_bytes'],
+            ))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'pcts_version': __version__,
+            'python_version': platform.python_version(),
+            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    print('Wrote results to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import datetime
+import random
+
+
+class BenchmarkPullRequest:
+    """Stand-in for pcts.github.PullRequest exposing the attributes used when indexing reports"""
+    def __init__(self, number=1, base_ref='production', repo='git@github.com:example/control-repo.git',
+                 updated_time=None):
+        self.number = number
+        self.base_ref = base_ref
+        self.repo = repo
+        self.updated_time = updated_time or datetime.datetime(2016, 1, 1)
+
+
+def node_names(node_count):
+    return ['node{:05d}.example.com'.format(i) for i in range(node_count)]
+
+
+def sample_nodes(rng, names, fraction):
+    return rng.sample(names, max(1, int(len(names) * fraction)))
+
+
+def percent(count, total):
+    return round(100.0 * count / total, 2) if total else 0
+
+
+def generate_report(node_count, compilation_errors=0, resource_types=0, conflicting_resources=0,
+                    attribute_issues=0, added_edges=0, warnings=0, affected_fraction=0.1, seed=0):
+    """Build a synthetic report with the shape of `puppet preview --view overview-json`
+
+    Every compilation error, conflicting resource, attribute issue and added
+    edge is attributed to a random `affected_fraction` of the nodes. The same
+    parameters and seed always produce the same report.
+    """
+    rng = random.Random(seed)
+    names = node_names(node_count)
+
+    failed_nodes = set()
+    preview_compilation_errors = []
+    for i in range(compilation_errors):
+        manifest = '/etc/puppetlabs/code/environments/pr_1/modules/mod{0}/manifests/init.pp'.format(i)
+        error_nodes = sample_nodes(rng, names, affected_fraction)
+        failed_nodes.update(error_nodes)
+        preview_compilation_errors.append({
+            'manifest': manifest,
+            'nodes': error_nodes,
+            'errors': [{
+                'message': 'Evaluation Error: Unknown variable: \'mod{0}::setting\' on node {1}'.format(
+                    i, error_nodes[0]),
+                'line': rng.randint(1, 200),
+                'pos': rng.randint(1, 80),
+            }],
+        })
+
+    warning_count_by_issue_code = []
+    for i in range(warnings):
+        manifests = dict()
+        for j in range(rng.randint(1, 5)):
+            manifest = '/etc/puppetlabs/code/environments/pr_1/modules/mod{0}/manifests/warn{1}.pp'.format(i, j)
+            manifests[manifest] = ['{0}:{1}'.format(rng.randint(1, 200), rng.randint(1, 80))
+                                   for _ in range(rng.randint(1, 3))]
+        warning_count_by_issue_code.append({
+            'issue_code': 'ISSUE_{}'.format(i),
+            'count': sum(len(locs) for locs in manifests.values()),
+            'manifests': manifests,
+        })
+
+    resource_type_changes = dict()
+    for i in range(resource_types):
+        resource_type = 'Type{}'.format(i)
+        conflicting = dict()
+        for j in range(conflicting_resources):
+            file = '/etc/puppetlabs/code/environments/pr_1/modules/mod{0}/manifests/res{1}.pp:{2}'.format(
+                i, j, rng.randint(1, 200))
+            conflicting['title{}'.format(j)] = {file: sample_nodes(rng, names, affected_fraction)}
+        issues = dict()
+        for k in range(attribute_issues):
+            conflicting_in = dict()
+            for title, files in conflicting.items():
+                for file, resource_nodes in files.items():
+                    conflicting_in[title] = {file: sample_nodes(rng, resource_nodes, 0.5)}
+            issues['attribute{}'.format(k)] = {'conflicting_in': conflicting_in}
+        resource_type_changes[resource_type] = {
+            'conflicting_resources': conflicting,
+            'attribute_issues': issues,
+        }
+
+    edges = dict()
+    for i in range(added_edges):
+        source = 'Class[Mod{}]'.format(i % 50)
+        target = 'File[/etc/generated/{}]'.format(i)
+        edges.setdefault(source, dict())[target] = sample_nodes(rng, names, affected_fraction)
+
+    all_nodes = [
+        {
+            'name': name,
+            'error_count': 1 if name in failed_nodes else 0,
+            'warning_count': 0,
+            'exit_code': 1 if name in failed_nodes else 0,
+        }
+        for name in names]
+    conflicting_count = len(set(
+        node
+        for changes in resource_type_changes.values()
+        for files in changes['conflicting_resources'].values()
+        for resource_nodes in files.values()
+        for node in resource_nodes))
+    equal_count = max(0, node_count - len(failed_nodes) - conflicting_count)
+
+    return {
+        'stats': {
+            'node_count': node_count,
+            'equal': {'total': equal_count, 'percent': percent(equal_count, node_count)},
+            'conflicting': {'total': conflicting_count, 'percent': percent(conflicting_count, node_count)},
+            'failures': {
+                'total': len(failed_nodes),
+                'percent': percent(len(failed_nodes), node_count),
+                'preview': {'total': len(failed_nodes), 'percent': percent(len(failed_nodes), node_count)},
+            },
+        },
+        'preview': {
+            'compilation_errors': preview_compilation_errors,
+            'warning_count_by_issue_code': warning_count_by_issue_code,
+        },
+        'changes': {
+            'resource_type_changes': resource_type_changes,
+            'edge_changes': {
+                'added_edges': edges,
+            },
+        },
+        'all_nodes': all_nodes,
+    }
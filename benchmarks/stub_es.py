@@ -0,0 +1,80 @@
+import http.server
+import json
+import threading
+
+
+class StubElasticsearchHandler(http.server.BaseHTTPRequestHandler):
+    """Accepts every bulk request and acknowledges each action as created"""
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body):
+        raw = json.dumps(body).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.send_json({'version': {'number': '2.4.0'}})
+
+    def do_POST(self):
+        raw_body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.bytes_received += len(raw_body)
+        if not self.path.split('?')[0].endswith('/_bulk'):
+            self.send_json({'acknowledged': True})
+            return
+        lines = raw_body.decode('utf8').splitlines()
+        items = []
+        for line in lines[::2]:
+            op_type, meta = next(iter(json.loads(line).items()))
+            items.append({op_type: {
+                '_index': meta.get('_index'),
+                '_type': meta.get('_type'),
+                '_id': str(len(items)),
+                'status': 201,
+            }})
+        self.server.documents_received += len(items)
+        self.send_json({'took': 1, 'errors': False, 'items': items})
+
+    do_PUT = do_POST
+
+
+class StubElasticsearch:
+    """Local HTTP server standing in for Elasticsearch, run on a background thread"""
+    def __init__(self, host='127.0.0.1', port=0):
+        self.server = http.server.HTTPServer((host, port), StubElasticsearchHandler)
+        self.server.bytes_received = 0
+        self.server.documents_received = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def config(self):
+        host, port = self.server.server_address
+        return {'host': host, 'port': port, 'index': 'pcts-benchmark-{isoyear}.{isoweek}'}
+
+    @property
+    def bytes_received(self):
+        return self.server.bytes_received
+
+    @property
+    def documents_received(self):
+        return self.server.documents_received
+
+    def reset(self):
+        self.server.bytes_received = 0
+        self.server.documents_received = 0
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
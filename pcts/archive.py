@@ -0,0 +1,129 @@
+import asyncio
+import datetime
+import glob
+import gzip
+import json
+import logging
+import os
+
+
+def archive_name(message_id, merge_sha):
+    return '{0}-{1}'.format(merge_sha or 'unknown', message_id)
+
+
+def write_member(f, document):
+    data = gzip.compress(json.dumps(document).encode('utf8'))
+    offset = f.tell()
+    f.write(data)
+    return [offset, len(data)]
+
+
+def read_member(path, offset, length):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    return json.loads(gzip.decompress(data).decode('utf8'))
+
+
+def write_archive(directory, name, report, metadata, chunk_size):
+    """Write a raw preview report as a multi-member gzip file with an index of node offsets
+
+    The first member holds the report without `all_nodes`, and each following
+    member holds up to `chunk_size` entries of `all_nodes`. The index maps
+    every certname to its member so a single node can be read back without
+    decompressing the rest of the file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + '.json.gz')
+    header = dict((key, value) for key, value in report.items() if key != 'all_nodes')
+    nodes = report.get('all_nodes', [])
+    index = dict(metadata)
+    index.update({'chunks': [], 'nodes': dict()})
+
+    with open(path + '.tmp', 'wb') as f:
+        index['header'] = write_member(f, header)
+        for start in range(0, len(nodes), chunk_size):
+            chunk = nodes[start:start + chunk_size]
+            index['chunks'].append(write_member(f, chunk))
+            for node in chunk:
+                index['nodes'][node['name']] = len(index['chunks']) - 1
+    os.replace(path + '.tmp', path)
+
+    index_path = os.path.join(directory, name + '.index.json')
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(index_path + '.tmp', index_path)
+    return path
+
+
+def list_archives(directory):
+    return sorted(os.path.basename(path)[:-len('.index.json')]
+                  for path in glob.glob(os.path.join(directory, '*.index.json')))
+
+
+def load_index(directory, name):
+    with open(os.path.join(directory, name + '.index.json')) as f:
+        return json.load(f)
+
+
+def read_node(directory, name, certname):
+    """Read a node's `all_nodes` entry back from an archive
+
+    Only `all_nodes` is indexed by node. The node's compilation errors and
+    catalog changes are kept in the report's `preview` and `changes`
+    sections, grouped by manifest and resource, so they have to be read from
+    `read_report` instead.
+    """
+    index = load_index(directory, name)
+    offset, length = index['chunks'][index['nodes'][certname]]
+    for node in read_member(os.path.join(directory, name + '.json.gz'), offset, length):
+        if node['name'] == certname:
+            return node
+
+
+def read_report(directory, name):
+    index = load_index(directory, name)
+    path = os.path.join(directory, name + '.json.gz')
+    report = read_member(path, *index['header'])
+    report['all_nodes'] = []
+    for offset, length in index['chunks']:
+        report['all_nodes'] += read_member(path, offset, length)
+    return report
+
+
+class ArchivedPullRequest:
+    """Stand-in for pcts.github.PullRequest built from an archive's index"""
+    def __init__(self, index):
+        self.number = index['pull_request']
+        self.base_ref = index['base_environment']
+        self.repo = index['repository']
+        self.merge_sha = index['merge_sha']
+        self.updated_time = datetime.datetime.strptime(index['updated_time'][:19], '%Y-%m-%dT%H:%M:%S')
+
+
+@asyncio.coroutine
+def archive_report(report, pr, archive_config, message_id):
+    logger = logging.getLogger(__name__)
+    if not archive_config['directory']:
+        return
+
+    name = archive_name(message_id=message_id, merge_sha=pr.merge_sha)
+    metadata = {
+        'message_id': str(message_id),
+        'merge_sha': pr.merge_sha,
+        'pull_request': pr.number,
+        'base_environment': pr.base_ref,
+        'repository': pr.repo,
+        'updated_time': pr.updated_time.isoformat(),
+    }
+    loop = asyncio.get_event_loop()
+    try:
+        path = yield from loop.run_in_executor(None, write_archive,
+                                               archive_config['directory'],
+                                               name,
+                                               report,
+                                               metadata,
+                                               archive_config.getint('chunk_size'))
+        logger.debug('Archived raw report to %s', path, extra={'MESSAGE_ID': message_id})
+    except Exception as e:
+        logger.warning('Failed to archive raw report: %s', e, extra={'MESSAGE_ID': message_id})
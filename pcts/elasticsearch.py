@@ -1,14 +1,17 @@
 import asyncio
+import collections
 import logging
 import re
 
 import elasticsearch
 import elasticsearch.helpers
 
+import pcts.timing
 
-def generate_actions(summary, nodes, errors, warnings, resource_changes, edge_changes, pr, index):
+
+def get_index_vars(pr):
     isoyear, isoweek, isoday = pr.updated_time.isocalendar()
-    index_vars = {
+    return {
         'isoday': isoday,
         'isoweek': isoweek,
         'isoyear': isoyear,
@@ -16,49 +19,76 @@ def generate_actions(summary, nodes, errors, warnings, resource_changes, edge_ch
         'month': pr.updated_time.month,
         'year': pr.updated_time.year,
     }
+
+
+def generate_actions(summary, nodes, errors, warnings, resource_changes, edge_changes, pr, index, message_id):
+    """Turn a processed report into bulk index actions
+
+    Documents get IDs made from the message ID, their type and their position
+    in the report, so indexing the same report again, e.g. with
+    pcts-reingest, replaces its documents instead of duplicating them.
+    """
+    index_vars = get_index_vars(pr)
     actions = []
-    summary.update({'_index': index.format(**index_vars), '_type': 'summary'})
-    actions.append(summary)
-    for node in nodes:
-        node.update({'_index': index.format(**index_vars),  '_type': 'node'})
-        actions.append(node)
-    for error in errors:
-        error.update({'_index': index.format(**index_vars),  '_type': 'error'})
-        actions.append(error)
-    for warning in warnings:
-        warning.update({'_index': index.format(**index_vars),  '_type': 'warning'})
-        actions.append(warning)
-    for resource_change in resource_changes:
-        resource_change.update({'_index': index.format(**index_vars),  '_type': 'resource_change'})
-        actions.append(resource_change)
-    for edge_change in edge_changes:
-        edge_change.update({'_index': index.format(**index_vars),  '_type': 'edge_change'})
-        actions.append(edge_change)
+    for doc_type, documents in (('summary', [summary]),
+                                ('node', nodes),
+                                ('error', errors),
+                                ('warning', warnings),
+                                ('resource_change', resource_changes),
+                                ('edge_change', edge_changes)):
+        for position, document in enumerate(documents):
+            document.update({
+                '_index': index.format(**index_vars),
+                '_type': doc_type,
+                '_id': '{0}-{1}-{2}'.format(message_id, doc_type, position),
+            })
+            actions.append(document)
     return actions
 
 
+def generate_timing_action(trace, pr, index):
+    timing = trace.to_document()
+    timing.update({
+        'pull_request': pr.number,
+        'base_environment': pr.base_ref,
+        'repository': pr.repo,
+        '_index': index.format(**get_index_vars(pr)),
+        '_type': 'timing',
+    })
+    return timing
+
+
 @asyncio.coroutine
-def send_to_es(actions, config, message_id):
+def send_to_es(actions, config, message_id, trace=None, chunk_size=500):
     logger = logging.getLogger(__name__)
+    trace = trace or pcts.timing.Trace(message_id=message_id)
     es = elasticsearch.Elasticsearch([{'host': config['host'], 'port': config['port']}])
-    logger.info('Submitting report to ElasticSearch at {0}:{1}'.format(config['host'], config['port']),
+    logger.info('Submitting report to ElasticSearch at %s:%s', config['host'], config['port'],
                 extra={
                     'MESSAGE_ID': message_id,
                     'ELASTICSEARCH_HOST': config['host'],
                     'ELASTICSEARCH_PORT': config['port'],
                 })
     try:
-        oks, fails = elasticsearch.helpers.bulk(client=es,
-                                                actions=actions,
-                                                raise_on_error=False,
-                                                raise_on_exception=False)
+        oks = 0
+        fails = []
+        for offset in range(0, len(actions), chunk_size):
+            chunk = actions[offset:offset + chunk_size]
+            with trace.span('bulk_chunk', offset=offset, document_count=len(chunk)):
+                chunk_oks, chunk_fails = elasticsearch.helpers.bulk(client=es,
+                                                                    actions=chunk,
+                                                                    chunk_size=chunk_size,
+                                                                    raise_on_error=False,
+                                                                    raise_on_exception=False)
+            oks += chunk_oks
+            fails += chunk_fails
         logger.info('Submitted report to ElasticSearch',
                     extra={
                         'MESSAGE_ID': message_id,
                         'ELASTICSEARCH_HOST': config['host'],
                         'ELASTICSEARCH_PORT': config['port'],
                     })
-        logger.debug('Successfully submitted {} documents to ElasticSearch'.format(oks),
+        logger.debug('Successfully submitted %s documents to ElasticSearch', oks,
                      extra={
                          'MESSAGE_ID': message_id,
                          'ELASTICSEARCH_HOST': config['host'],
@@ -96,6 +126,7 @@ def send_to_es(actions, config, message_id):
 def process_report(report, pr, message_id):
     nodes = report['all_nodes'].copy()
     errors = []
+    warnings = []
     resource_changes = []
     edge_changes = []
     for node in nodes:
@@ -135,7 +166,8 @@ def process_report(report, pr, message_id):
             for node in manifest_error['nodes']:
                 for error in deduped_errors:
                     error['message'] = error['message'].replace(node, '<node>')
-            deduped_errors = set(deduped_errors)
+            deduped_errors = [dict(error_items) for error_items in collections.OrderedDict.fromkeys(
+                tuple(sorted(error.items())) for error in deduped_errors)]
             for error in deduped_errors:
                 error_node = error.copy()
                 error_node['manifest'] = manifest_error['manifest']
@@ -253,18 +285,35 @@ def process_report(report, pr, message_id):
 
 
 @asyncio.coroutine
-def submit_report(report, pr, es_config, message_id):
+def submit_report(report, pr, es_config, message_id, trace=None):
     logger = logging.getLogger(__name__)
+    trace = trace or pcts.timing.Trace(message_id=message_id)
     logger.debug('Processing report data to send to ElasticSearch', extra={'MESSAGE_ID': message_id})
-    summary, nodes, errors, warnings, resource_changes, edge_changes = process_report(report, pr, message_id)
+    with trace.span('process_report'):
+        summary, nodes, errors, warnings, resource_changes, edge_changes = process_report(report, pr, message_id)
+    trace.count('report_nodes', len(nodes))
     logger.debug('Preparing processed data for submission to ElasticSearch', extra={'MESSAGE_ID': message_id})
-    actions = generate_actions(summary=summary,
-                               nodes=nodes,
-                               errors=errors,
-                               warnings=warnings,
-                               resource_changes=resource_changes,
-                               edge_changes=edge_changes,
-                               pr=pr,
-                               index=es_config['index'])
+    with trace.span('generate_actions'):
+        actions = generate_actions(summary=summary,
+                                   nodes=nodes,
+                                   errors=errors,
+                                   warnings=warnings,
+                                   resource_changes=resource_changes,
+                                   edge_changes=edge_changes,
+                                   pr=pr,
+                                   index=es_config['index'],
+                                   message_id=message_id)
+    trace.count('documents', len(actions))
     logger.debug('Attempting to send data to ElasticSearch', extra={'MESSAGE_ID': message_id})
-    yield from asyncio.wait_for(send_to_es(actions=actions, config=es_config, message_id=message_id), 60)
+    yield from asyncio.wait_for(send_to_es(actions=actions, config=es_config, message_id=message_id, trace=trace), 60)
+
+
+@asyncio.coroutine
+def submit_timing(trace, pr, es_config, message_id):
+    logger = logging.getLogger(__name__)
+    logger.debug('Attempting to send timing trace to ElasticSearch', extra={'MESSAGE_ID': message_id})
+    action = generate_timing_action(trace=trace, pr=pr, index=es_config['index'])
+    try:
+        yield from asyncio.wait_for(send_to_es(actions=[action], config=es_config, message_id=message_id), 60)
+    except Exception:
+        logger.warning('Failed to submit timing trace to ElasticSearch', extra={'MESSAGE_ID': message_id})
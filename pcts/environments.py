@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import time
+
+
+ENVIRONMENT_PATTERN = re.compile(r'^pr_\d+$')
+
+
+def environment_name(pr_number):
+    return 'pr_{}'.format(pr_number)
+
+
+def load_state(state_file):
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+
+
+def save_state(state_file, environments):
+    directory = os.path.dirname(state_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(environments, f, indent=2, sort_keys=True)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def get_size(path):
+    """Bytes removing the environment at `path` frees
+
+    Symlinked environments count as 0, as removing one only unlinks it and
+    leaves its target in place.
+    """
+    if os.path.islink(path):
+        return 0
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def select_evictions(environments, max_count, max_size, keep_warm, now, protect=()):
+    """Pick the least recently used environments to remove to get back within budget
+
+    A `max_count` or `max_size` of 0 means no limit. Environments used within
+    the last `keep_warm` seconds and those in `protect` are never picked, even
+    if that leaves the budget exceeded.
+    """
+    count = len(environments)
+    size = sum(environment['size'] for environment in environments.values())
+    evictions = []
+    for name in sorted(environments, key=lambda name: environments[name]['last_used']):
+        if (max_count <= 0 or count <= max_count) and (max_size <= 0 or size <= max_size):
+            break
+        if name in protect or now - environments[name]['last_used'] < keep_warm:
+            continue
+        evictions.append(name)
+        count -= 1
+        size -= environments[name]['size']
+    return evictions
+
+
+def touch(env_config, environment):
+    """Mark an environment as in use so it is kept warm while it is being tested"""
+    environments = load_state(env_config['state_file'])
+    environments.setdefault(environment, {'size': 0})['last_used'] = time.time()
+    save_state(env_config['state_file'], environments)
+
+
+@asyncio.coroutine
+def record_deploy(env_config, environment, message_id):
+    logger = logging.getLogger(__name__)
+    loop = asyncio.get_event_loop()
+    size = yield from loop.run_in_executor(None, get_size, os.path.join(env_config['directory'], environment))
+    environments = load_state(env_config['state_file'])
+    environments[environment] = {'last_used': time.time(), 'size': size}
+    save_state(env_config['state_file'], environments)
+    logger.debug('Environment %s uses %s bytes', environment, size, extra={'MESSAGE_ID': message_id})
+    yield from enforce_budget(env_config=env_config, message_id=message_id, protect=[environment])
+
+
+@asyncio.coroutine
+def enforce_budget(env_config, message_id, protect=()):
+    logger = logging.getLogger(__name__)
+    environments = load_state(env_config['state_file'])
+    evictions = select_evictions(environments=environments,
+                                 max_count=env_config.getint('max_count'),
+                                 max_size=env_config.getint('max_size'),
+                                 keep_warm=env_config.getfloat('keep_warm'),
+                                 now=time.time(),
+                                 protect=protect)
+    for environment in evictions:
+        logger.info('Evicting least recently used environment %s', environment,
+                    extra={'MESSAGE_ID': message_id})
+        yield from remove_environment(env_config=env_config, environment=environment, message_id=message_id)
+
+
+def delete_environment(path):
+    """Delete an environment directory, or the link to it for symlinked environments"""
+    try:
+        if os.path.islink(path):
+            os.unlink(path)
+        else:
+            shutil.rmtree(path)
+    except FileNotFoundError:
+        pass
+
+
+@asyncio.coroutine
+def remove_environment(env_config, environment, message_id):
+    """Remove a deployed environment, keeping track of it if that fails so it is retried on a later eviction"""
+    logger = logging.getLogger(__name__)
+    if not ENVIRONMENT_PATTERN.match(environment):
+        raise ValueError('Refusing to remove environment {} not created by pcts'.format(environment))
+
+    path = os.path.join(env_config['directory'], environment)
+    logger.debug('Removing environment directory %s', path, extra={'MESSAGE_ID': message_id})
+    loop = asyncio.get_event_loop()
+    try:
+        yield from loop.run_in_executor(None, delete_environment, path)
+    except OSError as e:
+        logger.warning('Failed to remove environment %s: %s', environment, e, extra={'MESSAGE_ID': message_id})
+        return
+
+    environments = load_state(env_config['state_file'])
+    environments.pop(environment, None)
+    save_state(env_config['state_file'], environments)
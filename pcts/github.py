@@ -1,29 +1,64 @@
 import asyncio
 import logging
+import time
 
 import github
 
+import pcts.recording
+
 
 class PullRequest:
     def __init__(self, payload, auth_token):
+        start = time.monotonic()
         self.gh_obj = github.Github(login_or_token=auth_token)
         self.repo_obj = self.gh_obj.get_repo(payload['repository']['id'])
         self.pr_obj = self.repo_obj.get_pull(payload['number'])
+        self.patches = dict()
+        if pcts.recording.enabled():
+            pcts.recording.record('github',
+                                  call='get_pull',
+                                  repository=payload['repository']['full_name'],
+                                  number=payload['number'],
+                                  response={
+                                      'repo': self.repo,
+                                      'base_ref': self.base_ref,
+                                      'merge_sha': self.merge_sha,
+                                      'updated_time': self.updated_time.isoformat(),
+                                  },
+                                  latency=time.monotonic() - start)
 
     @asyncio.coroutine
     def update_status(self, state: str, target_url: str, message_id, description: str=None):
         logger = logging.getLogger(__name__)
-        logger.info('Setting status on pull request #{0} for {1} to "{2}"'.format(
-            self.pr_obj.number,
-            self.repo_obj.full_name,
-            state
-        ), extra={'MESSAGE_ID': message_id})
+        logger.info('Setting status on pull request #%s for %s to "%s"',
+                    self.pr_obj.number,
+                    self.repo_obj.full_name,
+                    state,
+                    extra={'MESSAGE_ID': message_id})
+        start = time.monotonic()
         latest_commit = self.pr_obj.get_commits().reversed[0]
-        logger.debug('Using commit {} to set status'.format(latest_commit.sha), extra={'MESSAGE_ID': message_id})
+        logger.debug('Using commit %s to set status', latest_commit.sha, extra={'MESSAGE_ID': message_id})
         latest_commit.create_status(state=state, description=description, target_url=target_url, context='pcts')
+        pcts.recording.record('github',
+                              call='update_status',
+                              repository=self.repo_obj.full_name,
+                              number=self.number,
+                              state=state,
+                              latency=time.monotonic() - start)
 
     def get_files(self):
-        return [file.filename for file in self.pr_obj.get_files()]
+        start = time.monotonic()
+        pr_files = list(self.pr_obj.get_files())
+        files = [file.filename for file in pr_files]
+        self.patches = dict((file.filename, file.patch) for file in pr_files)
+        pcts.recording.record('github',
+                              call='get_files',
+                              repository=self.repo_obj.full_name,
+                              number=self.number,
+                              response=files,
+                              patches=self.patches,
+                              latency=time.monotonic() - start)
+        return files
 
     @property
     def number(self):
@@ -37,6 +72,10 @@ class PullRequest:
     def base_ref(self):
         return self.pr_obj.base.ref
 
+    @property
+    def merge_sha(self):
+        return self.pr_obj.merge_commit_sha
+
     @property
     def updated_time(self):
         return self.pr_obj.updated_at
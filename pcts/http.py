@@ -1,8 +1,13 @@
 import asyncio
+import collections
+import heapq
+import itertools
 import json
 import http.server
 import logging
+import re
 import socket
+import time
 import traceback
 import uuid
 
@@ -14,6 +19,8 @@ import aiohttp.web
 
 import systemd.daemon
 
+import pcts.recording
+
 
 def get_systemd_socket() -> socket.socket:
     """Shows how to get the socket"""
@@ -29,10 +36,101 @@ def get_systemd_socket() -> socket.socket:
     return socket.fromfd(SYSTEMD_FIRST_SOCKET_FD, address_family, socket_type)
 
 
-def handle_github_request(work_queue: asyncio.Queue):
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Events and actions handed to the worker, mapped to their queue priority.
+# Anything else is acknowledged with a 202 and dropped before its body is parsed.
+routes = {
+    'pull_request': {
+        'opened': PRIORITY_INTERACTIVE,
+        'reopened': PRIORITY_INTERACTIVE,
+        'synchronize': PRIORITY_INTERACTIVE,
+        'closed': PRIORITY_BULK,
+    },
+}
+
+DELIVERY_NEW = 'new'
+DELIVERY_DUPLICATE = 'duplicate'
+DELIVERY_REDELIVERY = 'redelivery'
+
+LEADING_ACTION_PATTERN = re.compile(r'\s*\{\s*"action"\s*:\s*"([^"]*)"')
+
+
+def get_action(raw_body: str) -> str:
+    """Read the action of a webhook payload
+
+    GitHub sends `action` as the first key, so it is usually read with a
+    regular expression and the payload is only parsed in full when it isn't.
+    """
+    match = LEADING_ACTION_PATTERN.match(raw_body)
+    if match:
+        return match.group(1)
+    return json.loads(raw_body).get('action')
+
+
+class DeliveryLog:
+    """Recently seen delivery IDs
+
+    A delivery ID seen again within `window` seconds is a duplicate. One seen
+    again after that is a redelivery, which is queued behind interactive events.
+    IDs are only recorded once their message has been queued, so a delivery
+    that was rejected can be sent again straight away.
+    """
+    def __init__(self, window: float, max_entries: int=10000):
+        self.window = window
+        self.max_entries = max_entries
+        self.seen = collections.OrderedDict()
+
+    def check(self, delivery_id: str) -> str:
+        first_seen = self.seen.get(delivery_id)
+        if first_seen is None:
+            return DELIVERY_NEW
+        if time.monotonic() - first_seen < self.window:
+            return DELIVERY_DUPLICATE
+        return DELIVERY_REDELIVERY
+
+    def record(self, delivery_id: str):
+        self.seen.pop(delivery_id, None)
+        self.seen[delivery_id] = time.monotonic()
+        while len(self.seen) > self.max_entries:
+            self.seen.popitem(last=False)
+
+
+class MessageHeap(list):
+    """Heap with the deque methods asyncio queues use for storage"""
+    def append(self, item):
+        heapq.heappush(self, item)
+
+    def popleft(self):
+        return heapq.heappop(self)
+
+
+class MessageQueue(asyncio.JoinableQueue):
+    """Bounded queue handing out messages by their `priority`, then in arrival order
+
+    Built on JoinableQueue rather than PriorityQueue, which only supports
+    join() and task_done() from Python 3.4.4.
+    """
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._queue = MessageHeap()
+        self._sequence = itertools.count()
+
+    def _put(self, message):
+        super()._put((message['priority'], next(self._sequence), message))
+
+    def _get(self):
+        return super()._get()[2]
+
+
+def handle_github_request(work_queue: asyncio.Queue, dedupe_window: float=600):
+    deliveries = DeliveryLog(window=dedupe_window)
+
     @asyncio.coroutine
     def request_handler(request: aiohttp.web.Request) -> aiohttp.web.Response:
         logger = logging.getLogger(__name__)
+        received = time.time()
 
         try:
             raw_message_id = request.headers.get('X-GitHub-Delivery')
@@ -47,15 +145,56 @@ def handle_github_request(work_queue: asyncio.Queue):
 
             event_type = request.headers.get('X-GitHub-Event')
 
-            logger.info('Received webhook for GitHub "{0}" event with id "{1}"'.format(event_type, message_id),
-                         extra={'MESSAGE_ID': message_id})
+            logger.info('Received webhook for GitHub "%s" event with id "%s"', event_type, message_id,
+                        extra={'MESSAGE_ID': message_id})
+
+            event_routes = routes.get(event_type)
+            if event_routes is None:
+                logger.debug('Ignoring GitHub "%s" event', event_type, extra={'MESSAGE_ID': message_id})
+                return aiohttp.web.Response(status=202, text='ignored')
+
+            delivery = deliveries.check(str(message_id)) if raw_message_id else DELIVERY_NEW
+            if delivery == DELIVERY_DUPLICATE:
+                logger.info('Ignoring duplicate delivery of message %s', message_id,
+                            extra={'MESSAGE_ID': message_id})
+                return aiohttp.web.Response(status=202, text='duplicate')
+
             raw_body = yield from request.text()
+            pcts.recording.record('deliveries',
+                                  id=message_id,
+                                  event=event_type,
+                                  received=received,
+                                  body=raw_body)
+
+            action = get_action(raw_body)
+            if action not in event_routes:
+                logger.debug('Ignoring GitHub "%s" event with action "%s"', event_type, action,
+                             extra={'MESSAGE_ID': message_id})
+                return aiohttp.web.Response(status=202, text='ignored')
+
+            priority = event_routes[action] if delivery == DELIVERY_NEW else PRIORITY_BULK
             queue_message = {
                 'event': event_type,
                 'id': message_id,
                 'body': json.loads(raw_body),
+                'priority': priority,
+                'timestamps': {
+                    'received': received,
+                },
             }
-            yield from work_queue.put(queue_message)
+            if priority == PRIORITY_INTERACTIVE:
+                yield from work_queue.put(queue_message)
+            else:
+                try:
+                    work_queue.put_nowait(queue_message)
+                except asyncio.QueueFull:
+                    logger.warning('Queue is full, rejecting message %s', message_id,
+                                   extra={'MESSAGE_ID': message_id})
+                    return aiohttp.web.Response(status=503, text='Queue full')
+            # Set once the message is actually queued, as interactive puts wait for space
+            queue_message['timestamps']['enqueued'] = time.time()
+            if raw_message_id:
+                deliveries.record(str(message_id))
             response = aiohttp.web.Response(status=200, text='ok')
             logger.debug('Sending response code 200')
         except ValueError as e:
@@ -71,15 +210,22 @@ def handle_github_request(work_queue: asyncio.Queue):
     return request_handler
 
 
-def start_server(event_loop: asyncio.BaseEventLoop, work_queue: asyncio.Queue) -> asyncio.base_events.Server:
+def make_app(event_loop: asyncio.BaseEventLoop, work_queue: asyncio.Queue,
+             dedupe_window: float=600) -> aiohttp.web.Application:
+    app = aiohttp.web.Application(loop=event_loop)
+    app.router.add_route('*', '/{tail:.*}', handle_github_request(work_queue=work_queue, dedupe_window=dedupe_window))
+    return app
+
+
+def start_server(event_loop: asyncio.BaseEventLoop, work_queue: asyncio.Queue,
+                 dedupe_window: float=600) -> asyncio.base_events.Server:
     logger = logging.getLogger(__name__)
 
     socket = get_systemd_socket()
 
     logger.info('Starting HTTP server')
 
-    app = aiohttp.web.Application(loop=event_loop)
-    app.router.add_route('*', '/{tail:.*}', handle_github_request(work_queue=work_queue))
+    app = make_app(event_loop, work_queue, dedupe_window=dedupe_window)
     f = event_loop.create_server(app.make_handler(), sock=socket)
     return event_loop.run_until_complete(f)
 
@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import os
+import re
+import time
+
+import yaml
+
+
+MODULE_PATTERN = re.compile(r'^(?:modules|site|dist)/([^/]+)/(.*)$')
+HIERA_DATA_PATTERN = re.compile(r'^(?:data|hieradata)/')
+TEMPLATE_CALL_PATTERN = re.compile(r'''\b(?:template|epp)\(\s*['"]([^'"$]+)['"]''')
+PUPPETFILE_MODULE_PATTERN = re.compile(r'''^\s*mod\s*\(?\s*['"]([^'"]+)['"]''')
+INTERPOLATION_PATTERN = re.compile(r'%\{([^}]*)\}')
+DEFINITION_PATTERN = re.compile(r'^\s*(?:class|define)\s+[a-z]', re.MULTILINE)
+
+MODULE_DIRECTORIES = ('modules', 'site', 'dist')
+# Module content catalogs can use without declaring any of the module's classes
+PLUGIN_DIRECTORIES = ('lib', 'facts.d', 'functions', 'types')
+
+# Files that never affect catalog compilation, at the top of the control
+# repository or of a module. Anywhere else, e.g. under a module's files/, they
+# may be served to nodes.
+IGNORED_PATTERNS = [re.compile(r'^((?:modules|site|dist)/[^/]+/)?' + pattern) for pattern in (
+    r'\.',
+    r'(spec|examples|tests|docs)/',
+    r'(README|CHANGELOG|LICENSE|Gemfile|Rakefile)[^/]*$',
+    r'[^/]*\.md$',
+)]
+
+# Template references found in each environment's manifests, keyed by the
+# resolved environment directory, as (expiry time, {reference: set of manifests})
+template_indexes = dict()
+
+
+def classify(filename):
+    """Work out how a changed file can affect catalogs
+
+    Returns a tuple of the kind of change and the detail needed to find the
+    nodes it affects:
+
+    * ('ignore', None) for documentation, tests and other files that never
+      affect catalogs
+    * ('manifest', filename) for manifests declaring resources
+    * ('template', 'module/path') for templates, as referenced from manifests
+    * ('hiera', filename) for environment hiera data
+    * ('puppetfile', None) for the Puppetfile
+    * ('unknown', filename) for anything else, including other module content
+      such as functions, types, facts and files, which may affect every node
+    """
+    if filename == 'Puppetfile':
+        return 'puppetfile', None
+
+    module_match = MODULE_PATTERN.match(filename)
+    if module_match:
+        module, path = module_match.groups()
+        if path.startswith('manifests/') and path.endswith('.pp'):
+            return 'manifest', filename
+        if path.startswith('templates/'):
+            return 'template', '{0}/{1}'.format(module, path[len('templates/'):])
+
+    if any(pattern.match(filename) for pattern in IGNORED_PATTERNS):
+        return 'ignore', None
+    if module_match:
+        return 'unknown', filename
+    if filename.endswith('.pp'):
+        return 'manifest', filename
+    if HIERA_DATA_PATTERN.match(filename):
+        return 'hiera', filename
+    return 'unknown', filename
+
+
+def quote(value):
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def manifest_clause(manifests):
+    return 'certname in resources[certname] {{ {} }}'.format(
+        ' or '.join('file ~ {}'.format(quote('^.*{}$'.format(manifest))) for manifest in sorted(manifests)))
+
+
+def module_clause(modules):
+    """Nodes declaring any of the classes or defined types of `modules`"""
+    names = [module.capitalize() for module in sorted(modules)]
+    return 'certname in resources[certname] {{ (type = "Class" and ({0})) or {1} }}'.format(
+        ' or '.join('title ~ {}'.format(quote('^{}(::|$)'.format(name))) for name in names),
+        ' or '.join('type ~ {}'.format(quote('^{}::'.format(name))) for name in names))
+
+
+def build_nodes_query(clauses):
+    """Build a PQL query for active nodes matching any of `clauses`, or every active node if `clauses` is None"""
+    query = ['nodes[certname] {', 'deactivated is null', 'and expired is null']
+    if clauses is not None:
+        query.append('and ({})'.format(' or '.join(clauses)))
+    query.append('}')
+    return ' '.join(query)
+
+
+def get_puppetfile_modules(patch):
+    """Names of the modules whose Puppetfile entries were changed by `patch`
+
+    Changed option lines are attributed to the `mod` declaration above them
+    in the same hunk. Returns None if a changed line can't be attributed to a
+    module, e.g. when a hunk starts in the middle of a module's options.
+    """
+    modules = set()
+    current_module = None
+    for line in patch.splitlines():
+        if line.startswith('+++') or line.startswith('---'):
+            continue
+        if line.startswith('@@'):
+            current_module = None
+            continue
+        match = PUPPETFILE_MODULE_PATTERN.match(line[1:])
+        if match:
+            current_module = re.split('[-/]', match.group(1))[-1]
+        if line[:1] in ('+', '-'):
+            if current_module is None:
+                return None
+            modules.add(current_module)
+    return modules
+
+
+def build_template_index(environment_dir):
+    index = dict()
+    for root, dirs, files in os.walk(environment_dir):
+        dirs[:] = [name for name in dirs if not name.startswith('.')]
+        for name in files:
+            if not name.endswith('.pp'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                with open(path, encoding='utf8', errors='replace') as f:
+                    references = TEMPLATE_CALL_PATTERN.findall(f.read())
+            except OSError:
+                continue
+            for reference in references:
+                index.setdefault(reference, set()).add(os.path.relpath(path, environment_dir))
+    return index
+
+
+def inspect_module(environment_dir, module):
+    """Look at how a module deployed in `environment_dir` can be used by catalogs
+
+    Returns None if the module isn't deployed there, or a tuple of whether its
+    manifests define classes or defined types and whether it has plugins.
+    """
+    for directory in MODULE_DIRECTORIES:
+        path = os.path.join(environment_dir, directory, module)
+        if os.path.isdir(path):
+            break
+    else:
+        return None
+
+    has_plugins = any(os.path.isdir(os.path.join(path, name)) for name in PLUGIN_DIRECTORIES)
+    for root, dirs, files in os.walk(os.path.join(path, 'manifests')):
+        for name in files:
+            if not name.endswith('.pp'):
+                continue
+            try:
+                with open(os.path.join(root, name), encoding='utf8', errors='replace') as f:
+                    if DEFINITION_PATTERN.search(f.read()):
+                        return True, has_plugins
+            except OSError:
+                continue
+    return False, has_plugins
+
+
+def normalize_variable(variable):
+    """Map a hiera interpolation to an inventory field, or None if it can't be matched against PuppetDB"""
+    variable = variable.strip()
+    if variable.startswith('::'):
+        variable = variable[2:]
+    if not re.match(r'^[\w.]+$', variable):
+        return None
+    if variable in ('trusted.certname', 'clientcert', 'certname', 'facts.clientcert'):
+        return 'certname'
+    if variable in ('environment', 'server_facts.environment'):
+        return 'environment'
+    if variable.startswith('facts.') or variable.startswith('trusted.'):
+        return variable
+    return 'facts.{}'.format(variable)
+
+
+def level_pattern(path, is_glob):
+    pattern = ''
+    variables = []
+    for i, part in enumerate(INTERPOLATION_PATTERN.split(path)):
+        if i % 2:
+            variables.append(part)
+            pattern += '([^/]+)'
+        else:
+            literal = re.escape(part)
+            if is_glob:
+                literal = literal.replace(r'\*', '[^/]*')
+            pattern += literal
+    return re.compile('^{}$'.format(pattern)), variables
+
+
+def load_hierarchy(environment_dir):
+    """Read the environment's hiera.yaml as a list of (datadir, path, is_glob) levels"""
+    with open(os.path.join(environment_dir, 'hiera.yaml')) as f:
+        hiera = yaml.safe_load(f) or dict()
+
+    levels = []
+    if hiera.get('version') == 5:
+        default_datadir = hiera.get('defaults', dict()).get('datadir', 'data')
+        for level in hiera.get('hierarchy', []):
+            datadir = level.get('datadir', default_datadir)
+            for key, is_glob in (('path', False), ('paths', False), ('glob', True), ('globs', True)):
+                paths = level.get(key, [])
+                for path in ([paths] if isinstance(paths, str) else paths):
+                    levels.append((datadir, path, is_glob))
+    else:
+        datadir = str(hiera.get(':yaml', dict()).get(':datadir', 'hieradata'))
+        datadir = re.split(r'%\{:*environment\}/', datadir)[-1]
+        for path in hiera.get(':hierarchy', []):
+            levels.append((datadir, '{}.yaml'.format(path), False))
+    return levels
+
+
+def hiera_clauses(filename, levels):
+    """PQL clauses selecting the nodes that can resolve data from `filename`, or None for every node"""
+    clauses = []
+    for datadir, path, is_glob in levels:
+        prefix = datadir.strip('/') + '/'
+        if not filename.startswith(prefix):
+            continue
+        pattern, variables = level_pattern(path, is_glob)
+        match = pattern.match(filename[len(prefix):])
+        if not match:
+            continue
+        if not variables:
+            return None
+
+        constraints = []
+        for variable, value in zip(variables, match.groups()):
+            field = normalize_variable(variable)
+            if field is None:
+                return None
+            constraints.append('{0} = {1}'.format(field, quote(value)))
+        clauses.append('certname in inventory[certname] {{ {} }}'.format(' and '.join(constraints)))
+    return clauses or None
+
+
+class ImpactAnalyzer:
+    """Find the smallest set of nodes whose catalogs a set of changed files can affect
+
+    `environment_dir` is a deployed copy of the environment the changes are
+    made against, which must be fully deployed before the analysis runs. It is
+    used to find manifests referencing changed templates, to read the hiera
+    hierarchy and to check that changed modules are only used through their
+    classes and defined types. `preview_environment_dir`, the deployed pull
+    request, is checked for the latter as well. Without them those changes
+    select every node. Template indexes are cached by the directory the
+    environment resolves to, so an environment redeployed in place rather than
+    through a new armature link can be read stale for up to `cache_ttl`.
+    """
+    def __init__(self, environment_dir=None, cache_ttl=300, preview_environment_dir=None):
+        self.environment_dir = environment_dir
+        self.preview_environment_dir = preview_environment_dir
+        self.cache_ttl = cache_ttl
+
+    @asyncio.coroutine
+    def get_template_index(self):
+        # armature deploys each commit to its own directory and links the
+        # environment to it, so a redeployed environment gets a fresh index
+        key = os.path.realpath(self.environment_dir)
+        cached = template_indexes.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        loop = asyncio.get_event_loop()
+        index = yield from loop.run_in_executor(None, build_template_index, key)
+        template_indexes[key] = (time.monotonic() + self.cache_ttl, index)
+        return index
+
+    @asyncio.coroutine
+    def selectable_by_class(self, module, allow_plugins):
+        """Whether every catalog a change to `module` can affect declares one of its classes or defined types
+
+        The module has to be deployed in at least one of the environments, and
+        define classes or defined types wherever it is deployed. Unless
+        `allow_plugins` is set it mustn't have plugins either, as functions,
+        types and facts are used without declaring anything from the module.
+        """
+        loop = asyncio.get_event_loop()
+        deployed = False
+        for environment_dir in (self.environment_dir, self.preview_environment_dir):
+            if not environment_dir or not os.path.isdir(environment_dir):
+                continue
+            usage = yield from loop.run_in_executor(None, inspect_module, environment_dir, module)
+            if usage is None:
+                continue
+            has_definitions, has_plugins = usage
+            if not has_definitions or (has_plugins and not allow_plugins):
+                return False
+            deployed = True
+        return deployed
+
+    @asyncio.coroutine
+    def get_clauses(self, filenames, patches, message_id):
+        """Build PQL clauses matching the affected nodes, or return None if every node may be affected"""
+        logger = logging.getLogger(__name__)
+        manifests = set()
+        modules = set()
+        clauses = []
+        levels = None
+
+        for filename in filenames:
+            kind, detail = classify(filename)
+            logger.debug('Treating %s as a %s change', filename, kind, extra={'MESSAGE_ID': message_id})
+
+            if kind == 'ignore':
+                continue
+            elif kind == 'manifest':
+                manifests.add(detail)
+            elif kind == 'template':
+                references = set()
+                if self.environment_dir and os.path.isdir(self.environment_dir):
+                    template_index = yield from self.get_template_index()
+                    references = template_index.get(detail, set())
+                module = detail.split('/')[0]
+                if references:
+                    manifests.update(references)
+                elif (yield from self.selectable_by_class(module, allow_plugins=True)):
+                    modules.add(module)
+                else:
+                    logger.info('Template %s may affect every node', filename, extra={'MESSAGE_ID': message_id})
+                    return None
+            elif kind == 'puppetfile':
+                changed_modules = get_puppetfile_modules(patches.get(filename) or '')
+                if not changed_modules:
+                    logger.info('Could not tell which modules changed in %s', filename,
+                                extra={'MESSAGE_ID': message_id})
+                    return None
+                for module in changed_modules:
+                    if not (yield from self.selectable_by_class(module, allow_plugins=False)):
+                        logger.info('Module %s changed in %s may affect every node', module, filename,
+                                    extra={'MESSAGE_ID': message_id})
+                        return None
+                if self.environment_dir and os.path.isdir(self.environment_dir):
+                    template_index = yield from self.get_template_index()
+                    for reference, references in template_index.items():
+                        if reference.split('/')[0] in changed_modules:
+                            manifests.update(references)
+                modules.update(changed_modules)
+            elif kind == 'hiera':
+                if levels is None:
+                    try:
+                        levels = load_hierarchy(self.environment_dir) if self.environment_dir else []
+                    except (OSError, yaml.YAMLError) as e:
+                        logger.warning('Could not read hiera hierarchy: %s', e, extra={'MESSAGE_ID': message_id})
+                        levels = []
+                level_clauses = hiera_clauses(filename, levels)
+                if level_clauses is None:
+                    logger.info('Hiera data %s may affect every node', filename,
+                                extra={'MESSAGE_ID': message_id})
+                    return None
+                clauses += level_clauses
+            else:
+                logger.info('Change to %s may affect every node', filename, extra={'MESSAGE_ID': message_id})
+                return None
+
+        if manifests:
+            clauses.append(manifest_clause(manifests))
+        if modules:
+            clauses.append(module_clause(modules))
+        return clauses
@@ -0,0 +1,81 @@
+import itertools
+import logging
+import logging.handlers
+import queue
+
+
+class Payload:
+    """Bulky log argument, such as a node list or a PQL query
+
+    Nothing is rendered unless a handler formats the record, and then only
+    the first `limit` characters are kept. Pass it as a %-style argument:
+
+        logger.debug('Using preview command: %s', Payload(command))
+
+    """
+    limit = 2000
+
+    def __init__(self, value, separator=' '):
+        self.value = value
+        self.separator = separator
+
+    def __str__(self):
+        if isinstance(self.value, str):
+            if len(self.value) <= self.limit:
+                return self.value
+            return '{0}... ({1} more characters)'.format(self.value[:self.limit], len(self.value) - self.limit)
+
+        parts = []
+        length = 0
+        items = iter(self.value)
+        for item in items:
+            part = str(item)
+            if length + len(part) > self.limit:
+                remaining = 1 + sum(1 for _ in items)
+                parts.append('... ({} more items)'.format(remaining))
+                break
+            parts.append(part)
+            length += len(part) + len(self.separator)
+        return self.separator.join(parts)
+
+
+class PayloadSampler(logging.Filter):
+    """Let through only one in `rate` records that carry a Payload argument"""
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        if self.rate <= 1 or not isinstance(record.args, tuple):
+            return True
+        if not any(isinstance(arg, Payload) for arg in record.args):
+            return True
+        return next(self.counter) % self.rate == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock QueueHandler renders the message before enqueueing it so that
+    records can cross process boundaries. Records here stay in-process, so
+    the logging thread can do that work instead of the event loop.
+    """
+    def prepare(self, record):
+        return record
+
+
+def start_queue_logging(handler, payload_limit=2000, sample_rate=1):
+    """Route records from the root logger through a queue to `handler` on a background thread
+
+    Returns the running QueueListener, which should be stopped on shutdown to
+    flush outstanding records.
+    """
+    Payload.limit = payload_limit
+    log_queue = queue.Queue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(PayloadSampler(sample_rate))
+    logging.getLogger().addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
@@ -1,4 +1,6 @@
 import pcts.http
+import pcts.logs
+import pcts.recording
 import pcts.worker
 
 import argparse
@@ -19,6 +21,10 @@ def parse_args():
                         help='The minimum severity of log messages to output for the main process')
     parser.add_argument('--internal-loglevel', type=str, choices=loglevels, default='WARN',
                         help='The minimum severity of log messages to output for internal components')
+    parser.add_argument('--log-payload-limit', type=int, default=2000,
+                        help='The maximum number of characters of bulky payloads, such as node lists, to log')
+    parser.add_argument('--log-payload-sample-rate', type=int, default=1,
+                        help='Only log one in this many messages carrying bulky payloads')
     parser.add_argument('-c', '--config', type=str, default='/etc/pcts.conf',
                         help='The configuration file to load from')
     parser.add_argument('-p', '--puppet', type=str, default='/opt/puppetlabs/bin/puppet',
@@ -37,6 +43,7 @@ def get_config(filename, puppet):
           'host_cert': `puppet config print hostcert`,
           'ca_cert': `puppet config print localcacert`,
         },
+        'cache_ttl': 300, # seconds to reuse PuppetDB query results and impact analysis indexes
       },
       'elasticsearch': {
         'host': 'localhost',
@@ -49,6 +56,24 @@ def get_config(filename, puppet):
       },
       'preview': {
         'excludes_file': '',
+      },
+      'recording': {
+        'directory': '', # record deliveries and responses for benchmarks.load when set
+      },
+      'webhooks': {
+        'queue_size': 100,
+        'dedupe_window': 600, # seconds within which a repeated delivery id is dropped
+      },
+      'archive': {
+        'directory': '', # keep compressed raw reports for pcts-reingest when set
+        'chunk_size': 64, # nodes per independently compressed block
+      },
+      'environments': {
+        'directory': `puppet config print environmentpath`, # first entry
+        'state_file': '/var/lib/pcts/environments.json',
+        'max_count': 100, # 0 for no limit
+        'max_size': 0, # bytes of environment directories, not counting symlinked ones, 0 for no limit
+        'keep_warm': 86400, # seconds since last use during which an environment is never evicted
       }
     }
 
@@ -67,6 +92,7 @@ def get_config(filename, puppet):
             'ssl_host_key': subprocess.check_output([puppet, 'config', 'print', 'hostprivkey'], universal_newlines=True).rstrip(),
             'ssl_host_cert': subprocess.check_output([puppet, 'config', 'print', 'hostcert'], universal_newlines=True).rstrip(),
             'ssl_ca_cert': subprocess.check_output([puppet, 'config', 'print', 'localcacert'], universal_newlines=True).rstrip(),
+            'cache_ttl': 300,
         },
         'elasticsearch': {
             'host': 'localhost',
@@ -83,6 +109,24 @@ def get_config(filename, puppet):
         },
         'preview': {
             'excludes_file': '',
+        },
+        'recording': {
+            'directory': '',
+        },
+        'webhooks': {
+            'queue_size': 100,
+            'dedupe_window': 600,
+        },
+        'archive': {
+            'directory': '',
+            'chunk_size': 64,
+        },
+        'environments': {
+            'directory': subprocess.check_output([puppet, 'config', 'print', 'environmentpath'], universal_newlines=True).rstrip().split(':')[0],
+            'state_file': '/var/lib/pcts/environments.json',
+            'max_count': 100,
+            'max_size': 0,
+            'keep_warm': 86400,
         }
     }
     config = configparser.ConfigParser()
@@ -93,28 +137,35 @@ def get_config(filename, puppet):
 
 
 def configure_logging(args):
-    logging.getLogger().addHandler(systemd.journal.JournalHandler(SYSLOG_IDENTIFIER='pcts'))
+    listener = pcts.logs.start_queue_logging(handler=systemd.journal.JournalHandler(SYSLOG_IDENTIFIER='pcts'),
+                                             payload_limit=args.log_payload_limit,
+                                             sample_rate=args.log_payload_sample_rate)
 
     print('log level main: {}'.format(args.loglevel.upper()))
     print('log level aiohttp: {}'.format(args.internal_loglevel.upper()))
     logging.getLogger(__name__.split('.')[0]).setLevel(getattr(logging, args.loglevel.upper()))
     logging.getLogger('aiohttp').setLevel(getattr(logging, args.internal_loglevel.upper()))
+    return listener
 
 
 def main():
     args = parse_args()
 
-    configure_logging(args)
+    log_listener = configure_logging(args)
 
-    logger = logging.getLogger(__name__)
+    try:
+        logger = logging.getLogger(__name__)
 
-    config = get_config(filename=args.config, puppet=args.puppet)
+        config = get_config(filename=args.config, puppet=args.puppet)
+        pcts.recording.configure(config['recording']['directory'])
 
-    loop = asyncio.get_event_loop()
-    queue = asyncio.JoinableQueue()
+        loop = asyncio.get_event_loop()
+        queue = pcts.http.MessageQueue(maxsize=config['webhooks'].getint('queue_size'))
 
-    srv = pcts.http.start_server(loop, queue)
-    worker = asyncio.async(pcts.worker.worker(queue=queue, config=config))
+        srv = pcts.http.start_server(loop, queue, dedupe_window=config['webhooks'].getfloat('dedupe_window'))
+        worker = asyncio.async(pcts.worker.worker(queue=queue, config=config))
 
-    loop.run_until_complete(pcts.http.stop_server(server=srv, queue=queue, worker=worker))
-    logger.info('Service shut down due to no activity.')
+        loop.run_until_complete(pcts.http.stop_server(server=srv, queue=queue, worker=worker))
+        logger.info('Service shut down due to no activity.')
+    finally:
+        log_listener.stop()
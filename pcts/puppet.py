@@ -1,18 +1,28 @@
+import pcts.environments
 import pcts.github
+import pcts.impact
+import pcts.logs
+import pcts.recording
+import pcts.timing
 
 import asyncio
 import json
 import logging
-import re
 import ssl
 import subprocess
+import time
 
 import aiohttp
 
 
+# Results of recent PuppetDB queries, keyed by (query URI, query), as (expiry time, result)
+query_cache = dict()
+
+
 @asyncio.coroutine
-def preview_compile(nodes, baseline_environment, preview_environment, config, message_id):
+def preview_compile(nodes, baseline_environment, preview_environment, config, message_id, trace=None):
     logger = logging.getLogger(__name__)
+    trace = trace or pcts.timing.Trace(message_id=message_id)
     command = [config['executables']['puppet'], 'preview',
                '--baseline-environment', baseline_environment,
                '--preview-environment', preview_environment,
@@ -22,17 +32,28 @@ def preview_compile(nodes, baseline_environment, preview_environment, config, me
         command += ['--excludes', config['preview']['excludes_file']]
     command += nodes
 
-    logger.info('Running puppet preview for message {}'.format(message_id), extra={'MESSAGE_ID': message_id})
-    logger.debug('Using preview command: {}'.format(' '.join(command)), extra={'MESSAGE_ID': message_id})
-
-    preview_process = yield from asyncio.create_subprocess_exec(*command,
-                                                                stdout=asyncio.subprocess.PIPE,
-                                                                stderr=asyncio.subprocess.PIPE,
-                                                                stdin=asyncio.subprocess.PIPE)
-    stdout, stderr = yield from preview_process.communicate(input="\n".join(nodes).encode('latin-1'))
-    return_code = yield from preview_process.wait()
-
-    logger.debug('Execution of puppet preview returned {}'.format(return_code), extra={'MESSAGE_ID': message_id})
+    logger.info('Running puppet preview for message %s', message_id, extra={'MESSAGE_ID': message_id})
+    logger.debug('Using preview command: %s', pcts.logs.Payload(command), extra={'MESSAGE_ID': message_id})
+
+    start = time.monotonic()
+    with trace.span('preview', node_count=len(nodes)):
+        preview_process = yield from asyncio.create_subprocess_exec(*command,
+                                                                    stdout=asyncio.subprocess.PIPE,
+                                                                    stderr=asyncio.subprocess.PIPE,
+                                                                    stdin=asyncio.subprocess.PIPE)
+        stdout, stderr = yield from preview_process.communicate(input="\n".join(nodes).encode('latin-1'))
+        return_code = yield from preview_process.wait()
+    trace.count('preview_stdout_bytes', len(stdout))
+    pcts.recording.record('preview',
+                          baseline_environment=baseline_environment,
+                          preview_environment=preview_environment,
+                          node_count=len(nodes),
+                          return_code=return_code,
+                          stdout=stdout.decode('utf8', errors='replace'),
+                          stderr=stderr.decode('utf8', errors='replace'),
+                          latency=time.monotonic() - start)
+
+    logger.debug('Execution of puppet preview returned %s', return_code, extra={'MESSAGE_ID': message_id})
 
     if return_code != 0:
         msg = "\n".join(['Execution of puppet preview failed!', stderr])
@@ -59,20 +80,28 @@ def preview_compile(nodes, baseline_environment, preview_environment, config, me
 
 
 @asyncio.coroutine
-def deploy_pr(pr: pcts.github.PullRequest, config, message_id):
+def deploy_pr(pr: pcts.github.PullRequest, config, message_id, trace=None):
     pr_ref = 'refs/pull/{}/merge'.format(pr.number)
-    environment_name = 'pr_{}'.format(pr.number)
-
-    yield from armature_deploy(ref=pr_ref,
-                               environment=environment_name,
-                               repo=pr.repo,
-                               executable=config['executables']['armature'],
-                               message_id=message_id)
-    yield from armature_deploy(ref=pr.base_ref,
-                               environment=pr.base_ref,
-                               repo=pr.repo,
-                               executable=config['executables']['armature'],
-                               message_id=message_id)
+    environment_name = pcts.environments.environment_name(pr.number)
+    trace = trace or pcts.timing.Trace(message_id=message_id)
+
+    pcts.environments.touch(env_config=config['environments'], environment=environment_name)
+    with trace.span('deploy', environment=environment_name):
+        yield from armature_deploy(ref=pr_ref,
+                                   environment=environment_name,
+                                   repo=pr.repo,
+                                   executable=config['executables']['armature'],
+                                   message_id=message_id)
+    with trace.span('environment_budget'):
+        yield from pcts.environments.record_deploy(env_config=config['environments'],
+                                                   environment=environment_name,
+                                                   message_id=message_id)
+    with trace.span('deploy', environment=pr.base_ref):
+        yield from armature_deploy(ref=pr.base_ref,
+                                   environment=pr.base_ref,
+                                   repo=pr.repo,
+                                   executable=config['executables']['armature'],
+                                   message_id=message_id)
 
 
 @asyncio.coroutine
@@ -80,23 +109,31 @@ def armature_deploy(ref, environment, repo, executable, message_id):
     logger = logging.getLogger(__name__)
     command = [executable, 'deploy-ref', repo, ref, environment]
 
-    logger.info('Deploying environment {} with armature'.format(environment), extra={'MESSAGE_ID': message_id})
-    logger.debug('Using armature command {}'.format(' '.join(command)), extra={'MESSAGE_ID': message_id})
+    logger.info('Deploying environment %s with armature', environment, extra={'MESSAGE_ID': message_id})
+    logger.debug('Using armature command %s', pcts.logs.Payload(command), extra={'MESSAGE_ID': message_id})
 
+    start = time.monotonic()
     preview_process = yield from asyncio.create_subprocess_exec(*command,
                                                                 stdout=asyncio.subprocess.PIPE,
                                                                 stderr=asyncio.subprocess.PIPE)
     stdout, stderr = yield from preview_process.communicate()
     return_code = yield from preview_process.wait()
+    pcts.recording.record('armature',
+                          ref=ref,
+                          environment=environment,
+                          return_code=return_code,
+                          stdout=stdout.decode('utf8', errors='replace'),
+                          stderr=stderr.decode('utf8', errors='replace'),
+                          latency=time.monotonic() - start)
 
-    logger.debug('Execution of armature returned {}'.format(return_code), extra={'MESSAGE_ID': message_id})
+    logger.debug('Execution of armature returned %s', return_code, extra={'MESSAGE_ID': message_id})
 
     if return_code != 0:
         msg = "\n".join(['Execution of armature failed!', stderr])
         logger.error(msg, extra={'MESSAGE_ID': message_id})
         raise subprocess.CalledProcessError(msg)
 
-    logger.debug('Successfully deployed environment {} with armature'.format(environment),
+    logger.debug('Successfully deployed environment %s with armature', environment,
                  extra={'MESSAGE_ID': message_id})
 
 
@@ -104,47 +141,63 @@ class PuppetDB:
     def __init__(self, pdb_config):
         logger = logging.getLogger(__name__)
         self.query_uri = '{}/pdb/query/v4'.format(pdb_config['base_uri'])
-        logger.debug('Querying against PuppetDB URI {}'.format(self.query_uri))
+        self.cache_ttl = pdb_config.getfloat('cache_ttl', 300)
+        logger.debug('Querying against PuppetDB URI %s', self.query_uri)
         self.ssl = {
             'host_key': pdb_config['ssl_host_key'],
             'host_cert': pdb_config['ssl_host_cert'],
             'ca_cert': pdb_config['ssl_ca_cert'],
         }
-        logger.debug('Using host_key file {} for PuppetDB querying'.format(self.ssl['host_key']))
-        logger.debug('Using host_cert file {} for PuppetDB querying'.format(self.ssl['host_cert']))
-        logger.debug('Using ca_cert file {} for PuppetDB querying'.format(self.ssl['ca_cert']))
+        logger.debug('Using host_key file %s for PuppetDB querying', self.ssl['host_key'])
+        logger.debug('Using host_cert file %s for PuppetDB querying', self.ssl['host_cert'])
+        logger.debug('Using ca_cert file %s for PuppetDB querying', self.ssl['ca_cert'])
 
     @asyncio.coroutine
-    def get_nodes_by_files(self, filenames, message_id):
+    def get_nodes_by_files(self, filenames, message_id, trace=None, environment_dir=None, patches=None,
+                           preview_environment_dir=None):
         logger = logging.getLogger(__name__)
+        trace = trace or pcts.timing.Trace(message_id=message_id)
         logger.info('Querying PuppetDB for nodes affected by the pull request', extra={'MESSAGE_ID': message_id})
 
-        files_partial = ' or '.join(
-            ['(file ~ "^.*{}$")'.format(filename)
-             for filename in filenames
-             if re.search('\.pp$', filename)])
+        analyzer = pcts.impact.ImpactAnalyzer(environment_dir=environment_dir,
+                                              cache_ttl=self.cache_ttl,
+                                              preview_environment_dir=preview_environment_dir)
+        with trace.span('impact_analysis'):
+            clauses = yield from analyzer.get_clauses(filenames=filenames, patches=patches or dict(), message_id=message_id)
+        if clauses is not None and not clauses:
+            logger.info('No changed files can affect any catalogs', extra={'MESSAGE_ID': message_id})
+            return []
 
-        query = ' '.join([
-            'nodes [certname] {'
-                'resources {',
-                    files_partial,
-                '}',
-                'and deactivated is null',
-                'and expired is null',
-            '}'])
+        query = pcts.impact.build_nodes_query(clauses)
 
-        logger.debug('Querying PuppetDB with PQL query: {}'.format(query))
+        logger.debug('Querying PuppetDB with PQL query: %s', pcts.logs.Payload(query), extra={'MESSAGE_ID': message_id})
 
-        raw_nodes = yield from self.query(query)
+        with trace.span('puppetdb_query'):
+            raw_nodes = yield from self.cached_query(query)
+        pcts.recording.record('puppetdb', message_id=message_id, query=query, response=raw_nodes)
 
         nodes = [node['certname'] for node in raw_nodes]
 
-        logger.debug("\n".join(['Nodes affected by the change:'] + nodes), extra={'MESSAGE_ID': message_id})
+        logger.debug('Nodes affected by the change:\n%s', pcts.logs.Payload(nodes, separator='\n'),
+                     extra={'MESSAGE_ID': message_id})
 
         return nodes
 
+    @asyncio.coroutine
+    def cached_query(self, query):
+        now = time.monotonic()
+        cached = query_cache.get((self.query_uri, query))
+        if cached and cached[0] > now:
+            return cached[1]
+        output = yield from self.query(query)
+        for key in [key for key, (expiry, _) in query_cache.items() if expiry <= now]:
+            del query_cache[key]
+        query_cache[(self.query_uri, query)] = (now + self.cache_ttl, output)
+        return output
+
     @asyncio.coroutine
     def query(self, query):
+        start = time.monotonic()
         sslcontext = ssl.create_default_context(cafile=self.ssl['ca_cert'])
         sslcontext.load_cert_chain(certfile=self.ssl['host_cert'], keyfile=self.ssl['host_key'])
         conn = aiohttp.TCPConnector(ssl_context=sslcontext, loop=asyncio.get_event_loop())
@@ -162,4 +215,5 @@ class PuppetDB:
                         yield from response.release()
         finally:
             session.close()
+        pcts.recording.record('puppetdb', query=query, response=output, latency=time.monotonic() - start)
         return output
@@ -0,0 +1,36 @@
+import json
+import logging
+import os
+import time
+
+
+directory = None
+
+
+def configure(record_directory):
+    """Start recording webhook deliveries and external responses into `record_directory`
+
+    An empty value disables recording. Each kind of interaction is appended as
+    JSON lines to `<record_directory>/<kind>.jsonl`, which together form a
+    replay bundle for the load harness in `benchmarks.load`.
+    """
+    global directory
+    logger = logging.getLogger(__name__)
+    if record_directory:
+        os.makedirs(record_directory, exist_ok=True)
+        logger.info('Recording deliveries and responses into %s', record_directory)
+        directory = record_directory
+    else:
+        directory = None
+
+
+def enabled():
+    return directory is not None
+
+
+def record(kind, **fields):
+    if directory is None:
+        return
+    fields['recorded'] = time.time()
+    with open(os.path.join(directory, '{}.jsonl'.format(kind)), 'a') as f:
+        f.write(json.dumps(fields, default=str) + '\n')
@@ -0,0 +1,74 @@
+import pcts.archive
+import pcts.elasticsearch
+import pcts.main
+
+import argparse
+import asyncio
+import concurrent.futures
+import logging
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Re-index archived raw reports into ElasticSearch')
+    parser.add_argument('archives', type=str, nargs='*',
+                        help='The archives to re-index, defaulting to every archive')
+    parser.add_argument('-c', '--config', type=str, default='/etc/pcts.conf',
+                        help='The configuration file to load from')
+    parser.add_argument('-p', '--puppet', type=str, default='/opt/puppetlabs/bin/puppet',
+                        help='The full path to the `puppet` executable')
+    parser.add_argument('-i', '--index', type=str,
+                        help='The index name pattern to write to instead of the configured one')
+    parser.add_argument('-j', '--parallel', type=int, default=4,
+                        help='The number of archives to process at once')
+    return parser.parse_args()
+
+
+def reingest_archive(name, directory, es_config, index):
+    archive_index = pcts.archive.load_index(directory, name)
+    message_id = archive_index['message_id']
+    pr = pcts.archive.ArchivedPullRequest(archive_index)
+    report = pcts.archive.read_report(directory, name)
+
+    summary, nodes, errors, warnings, resource_changes, edge_changes = pcts.elasticsearch.process_report(
+        report, pr, message_id)
+    actions = pcts.elasticsearch.generate_actions(summary=summary,
+                                                  nodes=nodes,
+                                                  errors=errors,
+                                                  warnings=warnings,
+                                                  resource_changes=resource_changes,
+                                                  edge_changes=edge_changes,
+                                                  pr=pr,
+                                                  index=index,
+                                                  message_id=message_id)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(pcts.elasticsearch.send_to_es(actions=actions, config=es_config, message_id=message_id))
+    finally:
+        loop.close()
+    return len(actions)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    config = pcts.main.get_config(filename=args.config, puppet=args.puppet)
+    directory = config['archive']['directory']
+    es_config = dict(config['elasticsearch'])
+    index = args.index or es_config['index']
+    names = args.archives or pcts.archive.list_archives(directory)
+
+    logger.info('Re-indexing %s archived reports into %s', len(names), index)
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.parallel) as executor:
+        futures = dict((executor.submit(reingest_archive, name, directory, es_config, index), name)
+                       for name in names)
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                logger.info('Re-indexed %s documents from %s', future.result(), futures[future])
+            except Exception as e:
+                failures += 1
+                logger.error('Failed to re-index %s: %s', futures[future], e)
+    if failures:
+        raise SystemExit('Failed to re-index {} archives'.format(failures))
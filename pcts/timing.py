@@ -0,0 +1,63 @@
+import contextlib
+import datetime
+import time
+
+
+def format_timestamp(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).isoformat() + 'Z'
+
+
+class Trace:
+    """Timeline of a single webhook delivery
+
+    Events are single points in time (received, enqueued, dequeued), spans
+    have a start and an end (deploys, queries, subprocesses, bulk chunks,
+    status posts) and counters accumulate sizes such as node counts and bytes
+    processed.
+    """
+    def __init__(self, message_id, timestamps=None):
+        self.message_id = message_id
+        self.events = []
+        self.spans = []
+        self.counters = dict()
+        if timestamps:
+            for event, timestamp in sorted(timestamps.items(), key=lambda item: item[1]):
+                self.mark(event, timestamp=timestamp)
+
+    def mark(self, event, timestamp=None, **fields):
+        if timestamp is None:
+            timestamp = time.time()
+        entry = {
+            'event': event,
+            'timestamp': format_timestamp(timestamp),
+        }
+        entry.update(fields)
+        self.events.append(entry)
+
+    @contextlib.contextmanager
+    def span(self, name, **fields):
+        start = time.time()
+        start_monotonic = time.monotonic()
+        entry = {
+            'span': name,
+            'start': format_timestamp(start),
+        }
+        entry.update(fields)
+        try:
+            yield entry
+        finally:
+            duration = time.monotonic() - start_monotonic
+            entry['end'] = format_timestamp(start + duration)
+            entry['duration'] = duration
+            self.spans.append(entry)
+
+    def count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_document(self):
+        return {
+            'message_id': self.message_id,
+            'events': list(self.events),
+            'spans': sorted(self.spans, key=lambda span: span['start']),
+            'counters': dict(self.counters),
+        }
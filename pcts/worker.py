@@ -1,10 +1,15 @@
+import pcts.archive
 import pcts.elasticsearch
+import pcts.environments
 import pcts.github
 import pcts.puppet
+import pcts.timing
 
 import asyncio
 import configparser
 import logging
+import os
+import time
 import traceback
 
 
@@ -20,10 +25,14 @@ def handler(event_type):
 
 @handler('pull_request')
 @asyncio.coroutine
-def handle_pull_request(payload, id, config):
+def handle_pull_request(payload, id, config, timestamps=None):
     logger = logging.getLogger('{}.worker'.format(__name__))
-    logger.debug('Handling message {}'.format(id),
+    logger.debug('Handling message %s', id,
                  extra={'MESSAGE_ID': id})
+    if payload.get('action') == 'closed':
+        yield from handle_closed_pull_request(payload=payload, id=id, config=config)
+        return
+    trace = pcts.timing.Trace(message_id=id, timestamps=timestamps)
 
     dashboard_vars = {
         'message_id': id,
@@ -32,55 +41,95 @@ def handle_pull_request(payload, id, config):
         'repo_full_name': payload['repository']['full_name'],
     }
     uri = config['elasticsearch']['dashboard'].format(**dashboard_vars)
-    logger.debug('Using {} for GitHub status URI'.format(uri))
+    logger.debug('Using %s for GitHub status URI', uri)
+    pr = None
     try:
         pr = pcts.github.PullRequest(payload=payload, auth_token=config['github']['auth_token'])
         pdb = pcts.puppet.PuppetDB(pdb_config=config['puppetdb'])
 
-        yield from pr.update_status(state='pending',
-                         target_url=uri,
-                         description='Testing of catalog compilation in progress',
-                         message_id=id)
+        with trace.span('status_post', state='pending'):
+            yield from pr.update_status(state='pending',
+                             target_url=uri,
+                             description='Testing of catalog compilation in progress',
+                             message_id=id)
 
-        pdb_f = asyncio.async(pdb.get_nodes_by_files(filenames=pr.get_files(), message_id=id))
-        deploy_f = asyncio.async(pcts.puppet.deploy_pr(pr=pr, config=config, message_id=id))
-        yield from asyncio.wait([pdb_f, deploy_f])
-        affected_nodes = pdb_f.result()
+        files = pr.get_files()
+        # Impact analysis reads the base environment, so it waits for the deploy
+        # rather than reading a missing or partly updated copy
+        yield from pcts.puppet.deploy_pr(pr=pr, config=config, message_id=id, trace=trace)
+        affected_nodes = yield from pdb.get_nodes_by_files(filenames=files,
+                                                           message_id=id,
+                                                           trace=trace,
+                                                           environment_dir=os.path.join(
+                                                               config['environments']['directory'], pr.base_ref),
+                                                           patches=pr.patches,
+                                                           preview_environment_dir=os.path.join(
+                                                               config['environments']['directory'],
+                                                               pcts.environments.environment_name(pr.number)))
+        trace.count('affected_nodes', len(affected_nodes))
 
         report = yield from pcts.puppet.preview_compile(nodes=affected_nodes,
                                                         baseline_environment=pr.base_ref,
-                                                        preview_environment='pr_{}'.format(pr.number),
+                                                        preview_environment=pcts.environments.environment_name(pr.number),
                                                         config=config,
-                                                        message_id=id)
+                                                        message_id=id,
+                                                        trace=trace)
+        with trace.span('archive'):
+            yield from pcts.archive.archive_report(report=report['raw'],
+                                                   pr=pr,
+                                                   archive_config=config['archive'],
+                                                   message_id=id)
         yield from pcts.elasticsearch.submit_report(report=report['raw'],
                                                           pr=pr,
                                                           es_config=config['elasticsearch'],
-                                                          message_id=id)
+                                                          message_id=id,
+                                                          trace=trace)
         if report['failure_count'] == 0:
             msg = 'All {} catalogs compiled successfully'.format(report['success_count'])
             logger.info(msg, extra={'MESSAGE_ID': id})
-            yield from pr.update_status(state='success',
-                                        target_url=uri,
-                                        description=msg,
-                                        message_id=id)
+            with trace.span('status_post', state='success'):
+                yield from pr.update_status(state='success',
+                                            target_url=uri,
+                                            description=msg,
+                                            message_id=id)
         else:
             msg = 'Compiled {0} catalogs successfully, but failed to compile catalogs for {1} nodes'.format(
                 report['success_count'],
                 report['failure_count'],
             )
             logger.info(msg, extra={'MESSAGE_ID': id})
-            yield from pr.update_status(state='failure',
-                                        target_url=uri,
-                                        description=msg,
-                                        message_id=id)
+            with trace.span('status_post', state='failure'):
+                yield from pr.update_status(state='failure',
+                                            target_url=uri,
+                                            description=msg,
+                                            message_id=id)
     except:
         logger.error('Caught exception when trying to test catalog compilation: {}'.format(traceback.format_exc()),
                      extra={'MESSAGE_ID': id})
-        yield from pr.update_status(state='error',
-                                    target_url=uri,
-                                    description='An exception occurred when trying to compile catalogs.',
-                                    message_id=id)
+        with trace.span('status_post', state='error'):
+            yield from pr.update_status(state='error',
+                                        target_url=uri,
+                                        description='An exception occurred when trying to compile catalogs.',
+                                        message_id=id)
         raise
+    finally:
+        trace.mark('finished')
+        if pr is not None:
+            yield from pcts.elasticsearch.submit_timing(trace=trace,
+                                                        pr=pr,
+                                                        es_config=config['elasticsearch'],
+                                                        message_id=id)
+
+
+@asyncio.coroutine
+def handle_closed_pull_request(payload, id, config):
+    logger = logging.getLogger('{}.worker'.format(__name__))
+    environment = pcts.environments.environment_name(payload['number'])
+    logger.info('Pull request #%s was closed, removing environment %s', payload['number'], environment,
+                extra={'MESSAGE_ID': id})
+    yield from pcts.environments.remove_environment(env_config=config['environments'],
+                                                    environment=environment,
+                                                    message_id=id)
 
 
 @asyncio.coroutine
@@ -89,17 +138,20 @@ def worker(queue: asyncio.JoinableQueue, config: configparser.ConfigParser):
     logger.info('Starting worker')
     while True:
         message = yield from queue.get()
-        logger.info('Processing message {0} of event type "{1}" from queue'.format(message['id'], message['event']),
+        timestamps = message.get('timestamps', dict())
+        timestamps['dequeued'] = time.time()
+        logger.info('Processing message %s of event type "%s" from queue', message['id'], message['event'],
                     extra={'MESSAGE_ID': message['id']})
         handler_f = handlers.get(message['event'])
         if handler_f:
             try:
-                yield from handler_f(payload=message['body'], id=message['id'], config=config)
+                yield from handler_f(payload=message['body'], id=message['id'], config=config,
+                                    timestamps=timestamps)
             except:
                 logger.error('Error received when processing message {0}: {1}'.format(message['id'],
                                                                                       traceback.format_exc()),
                              extra={'MESSAGE_ID': message['id']})
         else:
-            logger.info('No action to take on event type "{}"'.format(message['event']),
+            logger.info('No action to take on event type "%s"', message['event'],
                         extra={'MESSAGE_ID': message['id']})
         queue.task_done()
@@ -9,7 +9,7 @@ setup(
     name='pcts',
     version=__version__,
     py_modules=['pcts'],
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     include_package_data=True,
     author='Puppet SysOps Team',
     author_email='sysops-dept@puppet.com',
@@ -19,6 +19,7 @@ setup(
         'aiohttp',
         'elasticsearch',
         'pygithub',
+        'pyyaml',
         'python-systemd==231',
     ],
     dependency_links=['https://github.com/systemd/python-systemd/tarball/v231#egg=python-systemd-231'],
@@ -26,5 +27,6 @@ setup(
     entry_points='''
         [console_scripts]
         pcts-service=pcts.__main__.main()
+        pcts-reingest=pcts.reingest:main
     ''',
 )
@@ -0,0 +1,62 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pcts.archive
+
+
+def make_report(node_count):
+    return {
+        'stats': {'compliant': node_count},
+        'preview': {'compilation_errors': []},
+        'changes': {},
+        'all_nodes': [{'name': 'node{}.example.com'.format(i), 'status': 'equal'} for i in range(node_count)],
+    }
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, report, chunk_size=3):
+        return pcts.archive.write_archive(self.directory, 'abc123-message', report, {'message_id': 'message'},
+                                          chunk_size)
+
+    def test_report_round_trip(self):
+        report = make_report(10)
+        self.write(report)
+        self.assertEqual(pcts.archive.read_report(self.directory, 'abc123-message'), report)
+
+    def test_empty_report_round_trip(self):
+        report = make_report(0)
+        self.write(report)
+        self.assertEqual(pcts.archive.read_report(self.directory, 'abc123-message'), report)
+
+    def test_read_node_across_chunks(self):
+        report = make_report(10)
+        self.write(report)
+        index = pcts.archive.load_index(self.directory, 'abc123-message')
+        self.assertEqual(len(index['chunks']), 4)
+        self.assertEqual(index['message_id'], 'message')
+        for node in report['all_nodes']:
+            self.assertEqual(pcts.archive.read_node(self.directory, 'abc123-message', node['name']), node)
+
+    def test_archive_is_readable_with_gzip(self):
+        report = make_report(10)
+        path = self.write(report)
+        with gzip.open(path, 'rt') as f:
+            header, _ = json.JSONDecoder().raw_decode(f.read())
+        self.assertNotIn('all_nodes', header)
+        self.assertEqual(header['stats'], report['stats'])
+        self.assertEqual(pcts.archive.list_archives(self.directory), ['abc123-message'])
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import asyncio
+import configparser
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import pcts.environments
+
+
+def environment(last_used, size=0):
+    return {'last_used': last_used, 'size': size}
+
+
+class SelectEvictionsTest(unittest.TestCase):
+    def select(self, environments, max_count=0, max_size=0, keep_warm=0, protect=()):
+        return pcts.environments.select_evictions(environments=environments,
+                                                  max_count=max_count,
+                                                  max_size=max_size,
+                                                  keep_warm=keep_warm,
+                                                  now=1000,
+                                                  protect=protect)
+
+    def test_within_budget(self):
+        environments = {'pr_1': environment(100, 10), 'pr_2': environment(200, 10)}
+        self.assertEqual(self.select(environments, max_count=2, max_size=20), [])
+
+    def test_no_limits(self):
+        environments = {'pr_1': environment(100, 10), 'pr_2': environment(200, 10)}
+        self.assertEqual(self.select(environments), [])
+
+    def test_count_budget_evicts_least_recently_used(self):
+        environments = {'pr_1': environment(300), 'pr_2': environment(100), 'pr_3': environment(200)}
+        self.assertEqual(self.select(environments, max_count=1), ['pr_2', 'pr_3'])
+
+    def test_size_budget_evicts_until_under_limit(self):
+        environments = {'pr_1': environment(100, 50), 'pr_2': environment(200, 30), 'pr_3': environment(300, 20)}
+        self.assertEqual(self.select(environments, max_size=60), ['pr_1'])
+        self.assertEqual(self.select(environments, max_size=20), ['pr_1', 'pr_2'])
+
+    def test_keep_warm_environments_are_skipped(self):
+        environments = {'pr_1': environment(950), 'pr_2': environment(100), 'pr_3': environment(990)}
+        self.assertEqual(self.select(environments, max_count=1, keep_warm=100), ['pr_2'])
+
+    def test_protected_environments_are_skipped(self):
+        environments = {'pr_1': environment(100), 'pr_2': environment(200), 'pr_3': environment(300)}
+        self.assertEqual(self.select(environments, max_count=1, protect=['pr_1']), ['pr_2', 'pr_3'])
+
+
+class RemoveEnvironmentTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.directory = tempfile.mkdtemp()
+        config = configparser.ConfigParser()
+        config.read_dict({'environments': {
+            'directory': os.path.join(self.directory, 'environments'),
+            'state_file': os.path.join(self.directory, 'environments.json'),
+        }})
+        self.env_config = config['environments']
+        os.makedirs(self.env_config['directory'])
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.directory)
+
+    def remove(self, name):
+        self.loop.run_until_complete(pcts.environments.remove_environment(env_config=self.env_config,
+                                                                          environment=name,
+                                                                          message_id='test'))
+
+    def test_refuses_environments_not_created_by_pcts(self):
+        os.makedirs(os.path.join(self.env_config['directory'], 'production'))
+        with self.assertRaises(ValueError):
+            self.remove('production')
+        self.assertTrue(os.path.isdir(os.path.join(self.env_config['directory'], 'production')))
+
+    def test_removes_directory_and_state(self):
+        os.makedirs(os.path.join(self.env_config['directory'], 'pr_1', 'manifests'))
+        pcts.environments.save_state(self.env_config['state_file'], {'pr_1': environment(100, 10)})
+        self.remove('pr_1')
+        self.assertFalse(os.path.exists(os.path.join(self.env_config['directory'], 'pr_1')))
+        self.assertEqual(pcts.environments.load_state(self.env_config['state_file']), {})
+
+    def test_unlinks_symlinked_environment(self):
+        target = os.path.join(self.directory, 'cache')
+        os.makedirs(target)
+        os.symlink(target, os.path.join(self.env_config['directory'], 'pr_1'))
+        self.assertEqual(pcts.environments.get_size(os.path.join(self.env_config['directory'], 'pr_1')), 0)
+        self.remove('pr_1')
+        self.assertFalse(os.path.lexists(os.path.join(self.env_config['directory'], 'pr_1')))
+        self.assertTrue(os.path.isdir(target))
+
+    def test_keeps_state_when_removal_fails(self):
+        os.makedirs(os.path.join(self.env_config['directory'], 'pr_1'))
+        pcts.environments.save_state(self.env_config['state_file'], {'pr_1': environment(100, 10)})
+        with unittest.mock.patch('shutil.rmtree', side_effect=PermissionError('denied')):
+            self.remove('pr_1')
+        self.assertEqual(pcts.environments.load_state(self.env_config['state_file']), {'pr_1': environment(100, 10)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import unittest
+import unittest.mock
+
+import pcts.http
+
+
+class FakeRequest:
+    def __init__(self, event, delivery_id, body):
+        self.headers = {'X-GitHub-Event': event, 'X-GitHub-Delivery': delivery_id}
+        self.body = body
+
+    @asyncio.coroutine
+    def text(self):
+        return self.body
+
+
+def message(priority, name):
+    return {'priority': priority, 'name': name}
+
+
+class GetActionTest(unittest.TestCase):
+    def test_leading_action(self):
+        self.assertEqual(pcts.http.get_action('{"action": "opened", "number": 1}'), 'opened')
+
+    def test_action_after_other_keys(self):
+        self.assertEqual(pcts.http.get_action('{"number": 1, "action": "closed"}'), 'closed')
+
+    def test_missing_action(self):
+        self.assertIsNone(pcts.http.get_action('{"zen": "Keep it logically awesome."}'))
+
+
+class DeliveryLogTest(unittest.TestCase):
+    def test_new_until_recorded(self):
+        deliveries = pcts.http.DeliveryLog(window=600)
+        self.assertEqual(deliveries.check('a'), pcts.http.DELIVERY_NEW)
+        self.assertEqual(deliveries.check('a'), pcts.http.DELIVERY_NEW)
+
+    def test_duplicate_within_window(self):
+        deliveries = pcts.http.DeliveryLog(window=600)
+        with unittest.mock.patch('time.monotonic', return_value=1000):
+            deliveries.record('a')
+        with unittest.mock.patch('time.monotonic', return_value=1599):
+            self.assertEqual(deliveries.check('a'), pcts.http.DELIVERY_DUPLICATE)
+
+    def test_redelivery_after_window(self):
+        deliveries = pcts.http.DeliveryLog(window=600)
+        with unittest.mock.patch('time.monotonic', return_value=1000):
+            deliveries.record('a')
+        with unittest.mock.patch('time.monotonic', return_value=1600):
+            self.assertEqual(deliveries.check('a'), pcts.http.DELIVERY_REDELIVERY)
+
+    def test_oldest_entries_are_dropped(self):
+        deliveries = pcts.http.DeliveryLog(window=600, max_entries=2)
+        for delivery_id in ('a', 'b', 'c'):
+            deliveries.record(delivery_id)
+        self.assertEqual(deliveries.check('a'), pcts.http.DELIVERY_NEW)
+        self.assertEqual(deliveries.check('c'), pcts.http.DELIVERY_DUPLICATE)
+
+
+class MessageQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_priority_then_arrival_order(self):
+        queue = pcts.http.MessageQueue()
+        queue.put_nowait(message(pcts.http.PRIORITY_BULK, 'bulk 1'))
+        queue.put_nowait(message(pcts.http.PRIORITY_INTERACTIVE, 'interactive 1'))
+        queue.put_nowait(message(pcts.http.PRIORITY_BULK, 'bulk 2'))
+        queue.put_nowait(message(pcts.http.PRIORITY_INTERACTIVE, 'interactive 2'))
+        self.assertEqual([queue.get_nowait()['name'] for _ in range(4)],
+                         ['interactive 1', 'interactive 2', 'bulk 1', 'bulk 2'])
+
+    def test_bounded(self):
+        queue = pcts.http.MessageQueue(maxsize=1)
+        queue.put_nowait(message(pcts.http.PRIORITY_BULK, 'bulk 1'))
+        with self.assertRaises(asyncio.QueueFull):
+            queue.put_nowait(message(pcts.http.PRIORITY_INTERACTIVE, 'interactive 1'))
+
+    def test_join(self):
+        queue = pcts.http.MessageQueue()
+        queue.put_nowait(message(pcts.http.PRIORITY_BULK, 'bulk 1'))
+        queue.get_nowait()
+        queue.task_done()
+        self.loop.run_until_complete(asyncio.wait_for(queue.join(), 1))
+
+
+class RequestHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = pcts.http.MessageQueue(maxsize=1)
+        self.handler = pcts.http.handle_github_request(self.queue, dedupe_window=600)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def send(self, action, delivery_id):
+        body = json.dumps({'action': action, 'number': 1})
+        request = FakeRequest('pull_request', delivery_id, body)
+        return self.loop.run_until_complete(self.handler(request))
+
+    def test_queues_with_priority_and_timestamps(self):
+        response = self.send('opened', 'a')
+        self.assertEqual(response.status, 200)
+        queued = self.queue.get_nowait()
+        self.assertEqual(queued['priority'], pcts.http.PRIORITY_INTERACTIVE)
+        self.assertLessEqual(queued['timestamps']['received'], queued['timestamps']['enqueued'])
+
+    def test_ignores_unrouted_actions(self):
+        self.assertEqual(self.send('labeled', 'a').status, 202)
+        self.assertTrue(self.queue.empty())
+
+    def test_drops_duplicate_delivery(self):
+        self.send('opened', 'a')
+        self.queue.get_nowait()
+        self.assertEqual(self.send('opened', 'a').status, 202)
+        self.assertTrue(self.queue.empty())
+
+    def test_demotes_redelivery(self):
+        with unittest.mock.patch('time.monotonic', return_value=1000):
+            self.send('opened', 'a')
+        self.queue.get_nowait()
+        with unittest.mock.patch('time.monotonic', return_value=2000):
+            self.assertEqual(self.send('opened', 'a').status, 200)
+        self.assertEqual(self.queue.get_nowait()['priority'], pcts.http.PRIORITY_BULK)
+
+    def test_rejects_bulk_message_when_full(self):
+        self.send('opened', 'a')
+        self.assertEqual(self.send('closed', 'b').status, 503)
+        self.queue.get_nowait()
+        self.assertEqual(self.send('closed', 'b').status, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
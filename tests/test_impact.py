@@ -0,0 +1,190 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+import pcts.impact
+
+
+class ClassifyTest(unittest.TestCase):
+    def test_ignores_documentation_and_tests(self):
+        for filename in ('README.md', '.gitignore', '.github/CODEOWNERS', 'docs/index.md', 'spec/spec_helper.rb',
+                         'modules/ntp/README.md', 'modules/ntp/.fixtures.yml', 'modules/ntp/spec/classes/init_spec.rb',
+                         'site/role/examples/init.pp', 'dist/profile/tests/init.pp', 'modules/ntp/docs/usage.md'):
+            self.assertEqual(pcts.impact.classify(filename), ('ignore', None), filename)
+
+    def test_keeps_module_content_with_ignored_names(self):
+        self.assertEqual(pcts.impact.classify('modules/foo/templates/docs/x.erb'), ('template', 'foo/docs/x.erb'))
+        self.assertEqual(pcts.impact.classify('modules/foo/templates/.hidden.erb'), ('template', 'foo/.hidden.erb'))
+        self.assertEqual(pcts.impact.classify('site/role/files/docs/x.conf'),
+                         ('unknown', 'site/role/files/docs/x.conf'))
+        self.assertEqual(pcts.impact.classify('site/role/files/.bashrc'), ('unknown', 'site/role/files/.bashrc'))
+        self.assertEqual(pcts.impact.classify('modules/motd/files/README.md'),
+                         ('unknown', 'modules/motd/files/README.md'))
+        self.assertEqual(pcts.impact.classify('modules/ntp/manifests/init.pp'),
+                         ('manifest', 'modules/ntp/manifests/init.pp'))
+
+    def test_plugins_may_affect_every_node(self):
+        for filename in ('modules/stdlib/lib/puppet/functions/merge.rb', 'site/profile/lib/facter/role.rb',
+                         'modules/ntp/facts.d/ntp.txt', 'modules/stdlib/functions/ensure.pp',
+                         'modules/stdlib/types/port.pp'):
+            self.assertEqual(pcts.impact.classify(filename), ('unknown', filename))
+
+
+class GetPuppetfileModulesTest(unittest.TestCase):
+    def test_changed_option_is_attributed_to_its_module(self):
+        patch = '\n'.join([
+            "@@ -10,4 +10,4 @@ mod 'puppetlabs/stdlib', '4.12.0'",
+            " mod 'ntp',",
+            "   :git => 'https://github.com/example/puppet-ntp.git',",
+            "-  :ref => 'v1.0.0'",
+            "+  :ref => 'v1.1.0'",
+        ])
+        self.assertEqual(pcts.impact.get_puppetfile_modules(patch), {'ntp'})
+
+    def test_changed_module_declaration(self):
+        patch = '\n'.join([
+            "@@ -1,3 +1,3 @@",
+            " forge 'https://forgeapi.puppetlabs.com'",
+            "-mod 'puppetlabs/stdlib', '4.12.0'",
+            "+mod 'puppetlabs/stdlib', '4.13.0'",
+        ])
+        self.assertEqual(pcts.impact.get_puppetfile_modules(patch), {'stdlib'})
+
+    def test_multiple_hunks(self):
+        patch = '\n'.join([
+            "@@ -3,4 +3,4 @@",
+            " mod 'apache',",
+            "   :git => 'https://github.com/example/puppet-apache.git',",
+            "-  :ref => 'v2.0.0'",
+            "+  :ref => 'v2.1.0'",
+            "@@ -20,4 +20,4 @@",
+            " mod 'mysql',",
+            "   :git => 'https://github.com/example/puppet-mysql.git',",
+            "-  :ref => 'v3.0.0'",
+            "+  :ref => 'v3.1.0'",
+        ])
+        self.assertEqual(pcts.impact.get_puppetfile_modules(patch), {'apache', 'mysql'})
+
+    def test_module_does_not_carry_over_into_next_hunk(self):
+        patch = '\n'.join([
+            "@@ -3,4 +3,4 @@",
+            " mod 'apache',",
+            "   :git => 'https://github.com/example/puppet-apache.git',",
+            "-  :ref => 'v2.0.0'",
+            "+  :ref => 'v2.1.0'",
+            "@@ -40,3 +40,3 @@",
+            "   :git => 'https://github.com/example/puppet-mysql.git',",
+            "-  :ref => 'v3.0.0'",
+            "+  :ref => 'v3.1.0'",
+        ])
+        self.assertIsNone(pcts.impact.get_puppetfile_modules(patch))
+
+    def test_hunk_starting_inside_module_block(self):
+        patch = '\n'.join([
+            "@@ -12,3 +12,3 @@",
+            "   :git => 'https://github.com/example/puppet-ntp.git',",
+            "-  :ref => 'v1.0.0'",
+            "+  :ref => 'v1.1.0'",
+        ])
+        self.assertIsNone(pcts.impact.get_puppetfile_modules(patch))
+
+    def test_hunk_starting_inside_module_block_before_next_module(self):
+        patch = '\n'.join([
+            "@@ -12,5 +12,5 @@",
+            "-  :ref => 'v1.0.0'",
+            "+  :ref => 'v1.1.0'",
+            " ",
+            " mod 'mysql',",
+            "   :git => 'https://github.com/example/puppet-mysql.git',",
+        ])
+        self.assertIsNone(pcts.impact.get_puppetfile_modules(patch))
+
+    def test_changed_line_before_any_module(self):
+        patch = '\n'.join([
+            "@@ -1,2 +1,2 @@",
+            "-forge 'https://forgeapi.puppetlabs.com'",
+            "+forge 'https://forge.example.com'",
+            " mod 'puppetlabs/stdlib', '4.12.0'",
+        ])
+        self.assertIsNone(pcts.impact.get_puppetfile_modules(patch))
+
+
+class ImpactAnalyzerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.directory = tempfile.mkdtemp()
+        self.base = os.path.join(self.directory, 'production')
+        self.write(self.base, 'modules/ntp/manifests/init.pp', 'class ntp {\n}\n')
+        self.write(self.base, 'modules/ntp/templates/ntp.conf.erb', '')
+        self.write(self.base, 'modules/stdlib/manifests/init.pp', 'class stdlib {\n}\n')
+        self.write(self.base, 'modules/stdlib/lib/puppet/functions/merge.rb', '')
+        self.write(self.base, 'modules/facts/lib/facter/role.rb', '')
+        self.write(self.base, 'site/profile/manifests/ntp.pp',
+                   "class profile::ntp {\n  file { '/etc/ntp.conf': content => template('ntp/ntp.conf.erb') }\n}\n")
+        pcts.impact.template_indexes.clear()
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.directory)
+        pcts.impact.template_indexes.clear()
+
+    def write(self, environment_dir, filename, content):
+        path = os.path.join(environment_dir, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def get_clauses(self, filenames, patches=None, **kwargs):
+        analyzer = pcts.impact.ImpactAnalyzer(**kwargs)
+        return self.loop.run_until_complete(analyzer.get_clauses(filenames=filenames,
+                                                                 patches=patches or dict(),
+                                                                 message_id='test'))
+
+    def puppetfile_patch(self, module):
+        return '\n'.join(["@@ -1,2 +1,2 @@",
+                          "-mod '{}', '1.0.0'".format(module),
+                          "+mod '{}', '1.1.0'".format(module)])
+
+    def test_plugin_changes_select_every_node(self):
+        for filename in ('modules/ntp/lib/facter/ntp.rb', 'modules/ntp/facts.d/ntp.txt'):
+            self.assertIsNone(self.get_clauses([filename], environment_dir=self.base), filename)
+
+    def test_puppetfile_module_without_plugins(self):
+        clauses = self.get_clauses(['Puppetfile'], {'Puppetfile': self.puppetfile_patch('puppetlabs/ntp')},
+                                   environment_dir=self.base)
+        self.assertEqual(clauses, [pcts.impact.manifest_clause(['site/profile/manifests/ntp.pp']),
+                                   pcts.impact.module_clause(['ntp'])])
+
+    def test_puppetfile_module_with_plugins_selects_every_node(self):
+        self.assertIsNone(self.get_clauses(['Puppetfile'], {'Puppetfile': self.puppetfile_patch('puppetlabs/stdlib')},
+                                           environment_dir=self.base))
+
+    def test_puppetfile_module_gaining_plugins_selects_every_node(self):
+        preview = os.path.join(self.directory, 'pr_1')
+        self.write(preview, 'modules/ntp/manifests/init.pp', 'class ntp {\n}\n')
+        self.write(preview, 'modules/ntp/lib/facter/ntp.rb', '')
+        self.assertIsNone(self.get_clauses(['Puppetfile'], {'Puppetfile': self.puppetfile_patch('puppetlabs/ntp')},
+                                           environment_dir=self.base, preview_environment_dir=preview))
+
+    def test_puppetfile_module_without_environment_selects_every_node(self):
+        self.assertIsNone(self.get_clauses(['Puppetfile'], {'Puppetfile': self.puppetfile_patch('puppetlabs/ntp')}))
+
+    def test_referenced_template(self):
+        self.assertEqual(self.get_clauses(['modules/ntp/templates/ntp.conf.erb'], environment_dir=self.base),
+                         [pcts.impact.manifest_clause(['site/profile/manifests/ntp.pp'])])
+
+    def test_unreferenced_template_falls_back_to_module_classes(self):
+        self.assertEqual(self.get_clauses(['modules/ntp/templates/other.erb'], environment_dir=self.base),
+                         [pcts.impact.module_clause(['ntp'])])
+
+    def test_template_of_module_without_classes_selects_every_node(self):
+        self.assertIsNone(self.get_clauses(['modules/facts/templates/role.erb'], environment_dir=self.base))
+        self.assertIsNone(self.get_clauses(['modules/new/templates/new.erb'], environment_dir=self.base))
+
+
+if __name__ == '__main__':
+    unittest.main()